@@ -0,0 +1,169 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import cv2
+from typing import *
+
+from utils import read_file, read_ocr
+from main import Table, annotation_columns, visualize
+import synthetic
+
+STAGES = ["read", "metadata", "linking", "annotation", "visualization", "write"]
+
+# (rows, cols, words per cell) per sweep point
+SWEEPS = {
+    "small" : [(5, 3, 2), (10, 5, 3)],
+    "default" : [(5, 3, 2), (20, 6, 3), (50, 10, 4), (100, 20, 5)],
+    "large" : [(50, 10, 4), (100, 20, 5), (200, 30, 6)],
+}
+
+
+def time_table(root : str, name : str, out : str, visual : bool = True):
+    stages = {}
+    label_path = os.path.join(root, "labels_table", name + ".txt")
+    ocr_path = os.path.join(root, "ocr_labels", name + "_words.json")
+    image_path = os.path.join(root, "images_table", name + ".jpg")
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        boxes_element, h, w = read_file(label_path)
+        boxes_text = read_ocr(ocr_path, h, w)
+    stages["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = Table(boxes_text, boxes_element)
+    stages["metadata"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table.create_link()
+    stages["linking"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns = annotation_columns(table, boxes_text)
+    stages["annotation"] = time.perf_counter() - start
+
+    image = None
+    if visual:
+        start = time.perf_counter()
+        image = visualize(cv2.imread(image_path), columns.to_documents())
+        stages["visualization"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(os.path.join(out, name + ".json"), 'w') as f:
+        f.write(columns.encode(name))
+    if image is not None:
+        cv2.imwrite(os.path.join(out, name + ".jpg"), image)
+    stages["write"] = time.perf_counter() - start
+
+    counts = {
+        "words" : len(boxes_text),
+        "cells" : len(table.metadata),
+        "lines" : len(columns),
+        "links" : len(columns.edges)
+    }
+    return stages, counts
+
+def summarize(values : List[float]):
+    values = np.asarray(values, dtype = np.float64)
+    return {
+        "mean" : float(values.mean()),
+        "median" : float(np.median(values)),
+        "min" : float(values.min()),
+        "max" : float(values.max()),
+        "total" : float(values.sum())
+    }
+
+def run_config(root : str, config : Dict, tables : int, repeat : int, seed : int, visual : bool):
+    data = os.path.join(root, "r{rows}_c{cols}_w{words_per_cell}_h{header_rows}".format(**config))
+    out = os.path.join(data, "out")
+    os.makedirs(out, exist_ok = True)
+    names = synthetic.generate(data, tables, seed, **config)
+    timings = {stage : [] for stage in STAGES}
+    counts = []
+    for _ in range(repeat):
+        for name in names:
+            stages, count = time_table(data, name, out, visual)
+            for stage, value in stages.items():
+                timings[stage].append(value)
+            counts.append(count)
+    return {
+        "config" : config,
+        "tables" : tables,
+        "repeat" : repeat,
+        "stages" : {stage : summarize(values) for stage, values in timings.items() if len(values) > 0},
+        "counts" : {key : summarize([c[key] for c in counts])["mean"] for key in counts[0]}
+    }
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit" : commit,
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "opencv" : cv2.__version__,
+        "machine" : platform.machine()
+    }
+
+def compare(old : Dict, new : Dict):
+    # median time per stage, new / old, for configs present in both files
+    old_runs = {json.dumps(run["config"], sort_keys = True) : run for run in old["runs"]}
+    for run in new["runs"]:
+        key = json.dumps(run["config"], sort_keys = True)
+        if key not in old_runs:
+            continue
+        ratios = []
+        for stage, stats in run["stages"].items():
+            before = old_runs[key]["stages"].get(stage)
+            if before is not None and before["median"] > 0:
+                ratios.append(f"{stage} {stats['median'] / before['median']:.2f}x")
+        print(key, " ".join(ratios))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sweep", choices = list(SWEEPS.keys()), default = "default")
+    parser.add_argument("--tables", type = int, default = 3)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--header-rows", type = int, default = 2)
+    parser.add_argument("--spanning", type = int, default = 2)
+    parser.add_argument("--projected", type = int, default = 2)
+    parser.add_argument("--lines-per-cell", type = int, default = 1)
+    parser.add_argument("--no-visual", action = "store_true")
+    parser.add_argument("--root", default = None)
+    parser.add_argument("--output", default = "bench_results.json")
+    parser.add_argument("--compare", default = None)
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix = "table_bench_")
+    results = {"meta" : metadata(), "runs" : []}
+    for rows, cols, words in SWEEPS[args.sweep]:
+        config = {
+            "rows" : rows,
+            "cols" : cols,
+            "words_per_cell" : words,
+            "header_rows" : args.header_rows,
+            "spanning" : args.spanning,
+            "projected" : args.projected,
+            "lines_per_cell" : args.lines_per_cell
+        }
+        run = run_config(root, config, args.tables, args.repeat, args.seed, not args.no_visual)
+        results["runs"].append(run)
+        print(f"rows={rows} cols={cols} words={words} " + " ".join(f"{stage}={stats['median'] * 1000:.2f}ms" for stage, stats in run["stages"].items()))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), results)
@@ -0,0 +1,128 @@
+import os
+import shutil
+import hashlib
+import argparse
+import functools
+from typing import *
+
+
+def digest(*parts):
+    # sha256 over the parts, each length prefixed so different splits can not collide
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+def file_digest(path : str):
+    with open(path, "rb") as f:
+        return digest(f.read())
+
+
+class ResultCache(object):
+    """On-disk cache of table documents keyed by the content of their inputs.
+
+    Entries live in `<root>/<version>/<key[:2]>/<key>.json`, one directory per
+    rule version, so bumping the version makes every older entry a miss and
+    `invalidate` can drop them wholesale. A hit refreshes the entry's mtime;
+    `evict` removes the least recently used entries beyond `max_bytes`.
+    """
+
+    def __init__(self, root : str, version : str, max_bytes : int = None):
+        self.root = root
+        self.version = str(version)
+        self.max_bytes = max_bytes
+        self.dir = os.path.join(root, self.version)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts):
+        return digest(self.version, *parts)
+
+    def path(self, key : str):
+        return os.path.join(self.dir, key[:2], key + ".json")
+
+    def get(self, key : str):
+        # the stored document JSON, or None
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding = "utf-8") as f:
+                document = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return document
+
+    def put(self, key : str, document : str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            f.write(document)
+        os.replace(tmp, path)
+
+    def entries(self):
+        # (mtime, size, path) of every entry of every version
+        found = []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes : int = None):
+        # drops least recently used entries until the cache fits; returns how many were removed
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def invalidate(self, version : str = None):
+        """Removes the entries of `version`, or with None of every version but the current one."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if (version is None and name != self.version) or name == version:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors = True)
+
+
+@functools.lru_cache(maxsize = None)
+def open_cache(root : str, version : str):
+    return ResultCache(root, version)
+
+
+if __name__ == '__main__':
+    # python cache.py result_cache --version 2 --max-bytes 10000000000
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("--version", required = True, help = "current rule version; entries of other versions are removed")
+    parser.add_argument("--max-bytes", type = int, default = None)
+    args = parser.parse_args()
+
+    cache = ResultCache(args.root, args.version, args.max_bytes)
+    cache.invalidate()
+    print(f"evicted {cache.evict()} entries, {cache.size()} bytes left")
@@ -0,0 +1,71 @@
+import os
+from typing import *
+
+
+def truncate_partial_line(path : str):
+    # drops a trailing line left without its newline by an interrupted write
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            idx = chunk.rfind(b"\n")
+            if idx >= 0:
+                pos = pos - step + idx + 1
+                break
+            pos -= step
+        if pos < size:
+            f.truncate(pos)
+
+
+class Checkpoint(object):
+    """Append-only log of finished table names, one per line.
+
+    Reopening an existing log resumes from it: names already recorded are in
+    `done` and a line cut short by a crash is dropped. `finish` removes the
+    log once a run completes, so only an interrupted run is resumed.
+    """
+
+    def __init__(self, path : str, resume : bool = True, fsync : bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.done = set()
+        self.resumed = resume and os.path.exists(path)
+        if self.resumed:
+            truncate_partial_line(path)
+            with open(path, 'r', encoding = "utf-8") as f:
+                self.done = set(line.rstrip("\n") for line in f if line.strip())
+            self.file = open(path, 'a', encoding = "utf-8")
+        else:
+            self.file = open(path, 'w', encoding = "utf-8")
+
+    def __contains__(self, name):
+        return name in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, name : str):
+        self.file.write(name + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.done.add(name)
+
+    def close(self):
+        self.file.close()
+
+    def finish(self):
+        # the run completed: drop the log so the next run starts from scratch
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
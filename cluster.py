@@ -0,0 +1,106 @@
+import bisect
+import numpy as np
+from typing import *
+
+
+def center_rank(values):
+    # position of each item once all are stably sorted by value (ties keep input order)
+    values = np.asarray(values, dtype = np.float64)
+    rank = np.empty(len(values), dtype = np.int64)
+    rank[np.argsort(values, kind = "stable")] = np.arange(len(values))
+    return rank
+
+def cluster_by_center(centers, order = None, tolerance : float = 5):
+    """Groups items whose center is within `tolerance` of a seed's center.
+
+    Seeds are taken in `order` (default: input order); each seed collects
+    every still unassigned item with abs(center - seed center) <= tolerance,
+    which is what the pairwise `with_line` loops did. Items are swept once in
+    sorted center order with skip pointers over the assigned ones, so the
+    whole grouping costs O(n log n). Each group lists its members in `order`.
+    """
+    centers = np.asarray(centers, dtype = np.float64)
+    n = len(centers)
+    if order is None:
+        order = range(n)
+    rank = np.empty(n, dtype = np.int64)
+    rank[np.asarray(order, dtype = np.int64)] = np.arange(n)
+
+    by_center = np.argsort(centers, kind = "stable")
+    sorted_centers = centers[by_center]
+    # windows are widened a little and then checked exactly, so rounding in
+    # `center - tolerance` can not change the result
+    eps = 1e-6
+    lo = np.searchsorted(sorted_centers, centers - tolerance - eps, side = "left").tolist()
+    hi = np.searchsorted(sorted_centers, centers + tolerance + eps, side = "right").tolist()
+    by_center = by_center.tolist()
+    values = centers.tolist()
+
+    nxt = list(range(n + 1))
+    def find(p):
+        root = p
+        while nxt[root] != root:
+            root = nxt[root]
+        while nxt[p] != root:
+            nxt[p], p = root, nxt[p]
+        return root
+
+    assigned = [False] * n
+    groups = []
+    for seed in order:
+        if assigned[seed]:
+            continue
+        members = []
+        p = find(lo[seed])
+        while p < hi[seed]:
+            j = by_center[p]
+            if abs(values[seed] - values[j]) <= tolerance:
+                members.append(j)
+                assigned[j] = True
+                nxt[p] = p + 1
+            p = find(p + 1)
+        members.sort(key = lambda i : rank[i])
+        groups.append(members)
+    return groups
+
+def chain_lines(items : List, same_line : Callable, spans):
+    """Greedy left-to-right chaining of items already sorted by xmin.
+
+    Item j joins the first open line (in creation order) whose rightmost item
+    satisfies `same_line(rightmost, j)`, otherwise it opens a new line. This
+    gives the same lines as growing one line at a time from each unassigned
+    seed, in a single pass.
+
+    `spans` holds the (ymin, ymax) of every item and `same_line` must be
+    False for items whose spans do not meet. Open lines are kept sorted by
+    the ymin of their rightmost item, so an item only tests the lines whose
+    rightmost ymin lies within one item height of its span: O(n log n) when
+    few lines share a y range.
+    """
+    spans = np.asarray(spans, dtype = np.float64).reshape(-1, 2)
+    # no two items can meet when their ymin are further apart than the tallest item
+    reach = float((spans[:, 1] - spans[:, 0]).max()) + 1e-6 if len(spans) > 0 else 0.0
+    spans = spans.tolist()
+    lines = []
+    rightmost = []
+    top = []
+    # (rightmost ymin, line) of every open line, sorted
+    keys = []
+    for j, item in enumerate(items):
+        ymin, ymax = spans[j]
+        lo = bisect.bisect_left(keys, (ymin - reach, -1))
+        hi = bisect.bisect_right(keys, (ymax, len(lines)))
+        for k in sorted(k for _, k in keys[lo:hi]):
+            if same_line(rightmost[k], item):
+                lines[k].append(j)
+                rightmost[k] = item
+                del keys[bisect.bisect_left(keys, (top[k], k))]
+                top[k] = ymin
+                bisect.insort(keys, (ymin, k))
+                break
+        else:
+            bisect.insort(keys, (ymin, len(lines)))
+            lines.append([j])
+            rightmost.append(item)
+            top.append(ymin)
+    return lines
@@ -0,0 +1,122 @@
+import json
+import numpy as np
+from typing import *
+
+LABELS = ["answer", "question", "other"]
+
+# the string encoder json.dumps(..., ensure_ascii=False) uses
+encode_string = json.encoder.encode_basestring
+
+
+def encode_text(text):
+    if isinstance(text, str):
+        return encode_string(text)
+    return json.dumps(text, ensure_ascii=False)
+
+def encode_boxes(boxes):
+    # "[xmin, ymin, xmax, ymax]" per row, floats written like json.dumps does
+    values = boxes.ravel().tolist()
+    if np.isfinite(boxes).all():
+        values = list(map(float.__repr__, values))
+    else:
+        values = [json.dumps(v) for v in values]
+    it = iter(values)
+    return ["[%s, %s, %s, %s]" % box for box in zip(it, it, it, it)]
+
+def group_offsets(owner, size : int):
+    # owner is sorted; rows of group i are [offsets[i], offsets[i + 1])
+    offsets = np.zeros(size + 1, dtype = np.int64)
+    np.cumsum(np.bincount(owner, minlength = size), out = offsets[1:])
+    return offsets.tolist()
+
+
+class AnnotationColumns(object):
+    """Annotation of one table as flat columns instead of a tree of dicts.
+
+    Line i has box `boxes[i]`, text `texts[i]`, id `ids[i]` and, when the
+    schema has labels, label `LABELS[labels[i]]`. Its words are the rows of
+    `word_boxes` / `word_texts` with `word_line == i` and its links the rows
+    of `edges` with `edge_line == i`; both are sorted by line.
+    """
+    __slots__ = ("boxes", "texts", "ids", "labels", "word_line", "word_boxes", "word_texts", "edge_line", "edges")
+
+    def __init__(self, boxes, texts : List[str], ids, labels = None, word_line = None, word_boxes = None, word_texts = None,
+                 edge_line = None, edges = None):
+        self.boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+        self.texts = list(texts)
+        self.ids = np.asarray(ids, dtype = np.int64)
+        self.labels = None if labels is None else np.asarray(labels, dtype = np.int8)
+        self.word_line = np.zeros(0, dtype = np.int64) if word_line is None else np.asarray(word_line, dtype = np.int64)
+        self.word_boxes = np.zeros((0, 4)) if word_boxes is None else np.asarray(word_boxes, dtype = np.float64).reshape(-1, 4)
+        self.word_texts = [] if word_texts is None else list(word_texts)
+        self.edge_line = np.zeros(0, dtype = np.int64) if edge_line is None else np.asarray(edge_line, dtype = np.int64)
+        self.edges = np.zeros((0, 2), dtype = np.int64) if edges is None else np.asarray(edges, dtype = np.int64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def from_documents(cls, documents : List[Dict]):
+        # inverse of to_documents, e.g. for a document read back from JSON
+        words = [w for doc in documents for w in doc["word"]]
+        edges = [e for doc in documents for e in doc["linking"]]
+        labels = None
+        if all("label" in doc for doc in documents):
+            labels = [LABELS.index(doc["label"]) for doc in documents]
+        return cls(
+            boxes = [doc["box"] for doc in documents],
+            texts = [doc["text"] for doc in documents],
+            ids = [doc["id"] for doc in documents],
+            labels = labels,
+            word_line = np.repeat(np.arange(len(documents)), [len(doc["word"]) for doc in documents]),
+            word_boxes = [w["box"] for w in words],
+            word_texts = [w["text"] for w in words],
+            edge_line = np.repeat(np.arange(len(documents)), [len(doc["linking"]) for doc in documents]),
+            edges = edges
+        )
+
+    def to_documents(self):
+        # the per-line dicts of the JSON schema
+        word_offsets = group_offsets(self.word_line, len(self))
+        edge_offsets = group_offsets(self.edge_line, len(self))
+        word_boxes = self.word_boxes.tolist()
+        edges = self.edges.tolist()
+        ids = self.ids.tolist()
+        documents = []
+        for i, (box, text) in enumerate(zip(self.boxes.tolist(), self.texts)):
+            doc = {
+                "box" : box,
+                "text" : text,
+                "word" : [{"box" : word_boxes[j], "text" : self.word_texts[j]} for j in range(word_offsets[i], word_offsets[i + 1])],
+                "id" : ids[i]
+            }
+            if self.labels is not None:
+                doc["label"] = LABELS[self.labels[i]]
+            doc["linking"] = edges[edge_offsets[i]:edge_offsets[i + 1]]
+            documents.append(doc)
+        return documents
+
+    def encode_document(self):
+        # the JSON of the "document" list alone
+        word_offsets = group_offsets(self.word_line, len(self))
+        edge_offsets = group_offsets(self.edge_line, len(self))
+        words = ['{"box": %s, "text": %s}' % (box, encode_text(text)) for box, text in zip(encode_boxes(self.word_boxes), self.word_texts)]
+        edges = ["[%d, %d]" % (head, tail) for head, tail in self.edges.tolist()]
+        labels = [', "label": "%s"' % LABELS[label] for label in self.labels.tolist()] if self.labels is not None else [""] * len(self)
+        lines = []
+        for i, (box, text, idx, label) in enumerate(zip(encode_boxes(self.boxes), self.texts, self.ids.tolist(), labels)):
+            lines.append('{"box": %s, "text": %s, "word": [%s], "id": %d%s, "linking": [%s]}' % (
+                box, encode_text(text), ", ".join(words[word_offsets[i]:word_offsets[i + 1]]), idx, label,
+                ", ".join(edges[edge_offsets[i]:edge_offsets[i + 1]])))
+        return "[%s]" % ", ".join(lines)
+
+    def encode(self, name, **extra):
+        """JSON of {"id" : name, "document" : [...], **extra}, the same text
+        json.dumps(..., ensure_ascii=False) gives for the dict tree."""
+        return encode_table(name, self.encode_document(), **extra)
+
+
+def encode_table(name, document : str, **extra):
+    # a table line around an already encoded document
+    tail = "".join(', %s: %s' % (encode_string(key), json.dumps(value, ensure_ascii=False)) for key, value in extra.items())
+    return '{"id": %s, "document": %s%s}' % (encode_text(name), document, tail)
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import glob
+import struct
+import numpy as np
+from typing import *
+
+from shards import pad, RecordReader, open_index
+from checkpoint import truncate_partial_line
+from export import AnnotationColumns
+
+# record of one table graph, laid out like the shards.py records:
+# header (lines, links), indptr int64 (lines + 1), indices int64 (links),
+# line ids int64 (lines), line boxes float32 (lines, 4), labels int8 (lines, -1 without label)
+GRAPH = struct.Struct("<2q")
+
+
+def encode_graph(columns : AnnotationColumns):
+    """Packs the link graph of one table: row i of the CSR arrays holds the
+    positions of the lines line i links to, in the order of `linking`."""
+    num_lines = len(columns)
+    position = np.zeros(int(columns.ids.max()) + 1 if num_lines else 0, dtype = np.int64)
+    position[columns.ids] = np.arange(num_lines)
+    indptr = np.zeros(num_lines + 1, dtype = "<i8")
+    np.cumsum(np.bincount(columns.edge_line, minlength = num_lines), out = indptr[1:])
+    indices = position[columns.edges[:, 1]]
+    labels = columns.labels if columns.labels is not None else np.full(num_lines, -1)
+    parts = [
+        GRAPH.pack(num_lines, len(indices)),
+        indptr.tobytes(),
+        indices.astype("<i8").tobytes(),
+        columns.ids.astype("<i8").tobytes(),
+        np.ascontiguousarray(columns.boxes, dtype = "<f4").tobytes(),
+        np.asarray(labels, dtype = np.int8).tobytes() + b"\0" * (pad(num_lines) - num_lines)
+    ]
+    return b"".join(parts)
+
+
+class TableGraph(object):
+    """Link graph of one table; the arrays are read-only views into the shard."""
+    __slots__ = ("name", "indptr", "indices", "ids", "boxes", "labels")
+
+    def __init__(self, name : str, buffer, offset : int):
+        self.name = name
+        num_lines, num_links = GRAPH.unpack_from(buffer, offset)
+        pos = offset + GRAPH.size
+        self.indptr = np.frombuffer(buffer, dtype = "<i8", count = num_lines + 1, offset = pos)
+        pos += 8 * (num_lines + 1)
+        self.indices = np.frombuffer(buffer, dtype = "<i8", count = num_links, offset = pos)
+        pos += 8 * num_links
+        self.ids = np.frombuffer(buffer, dtype = "<i8", count = num_lines, offset = pos)
+        pos += 8 * num_lines
+        self.boxes = np.frombuffer(buffer, dtype = "<f4", count = 4 * num_lines, offset = pos).reshape(num_lines, 4)
+        pos += 16 * num_lines
+        self.labels = np.frombuffer(buffer, dtype = np.int8, count = num_lines, offset = pos)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def edges(self):
+        # (heads, tails) line positions of every link
+        heads = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return heads, self.indices
+
+
+class GraphWriter(object):
+    """Appends table graphs to `<stem>-00000.graph`, ... of about `max_bytes`
+    each and logs `[name, shard, offset, size]` per table to
+    `<stem>.graph-index.jsonl` once its record is written. With `append` the
+    graphs of an earlier run are kept and new ones go to a new shard.
+    """
+
+    def __init__(self, stem : str, max_bytes : int = 1 << 30, append : bool = False):
+        self.stem = stem
+        self.root = os.path.dirname(os.path.abspath(stem))
+        self.max_bytes = max_bytes
+        self.index_path = stem + ".graph-index.jsonl"
+        self.part = 0
+        self.shard = None
+        self.file = None
+        os.makedirs(self.root, exist_ok = True)
+        if append and os.path.exists(self.index_path):
+            truncate_partial_line(self.index_path)
+            parts = glob.glob(glob.escape(stem) + "-[0-9][0-9][0-9][0-9][0-9].graph")
+            self.part = max([int(p[len(stem) + 1:-len(".graph")]) + 1 for p in parts], default = 0)
+        self.index = open(self.index_path, 'a' if append else 'w', encoding = "utf-8")
+
+    def write(self, name : str, record : bytes):
+        if self.file is None or self.file.tell() >= self.max_bytes:
+            self.close_shard()
+            self.shard = f"{os.path.basename(self.stem)}-{self.part:05d}.graph"
+            self.part += 1
+            self.file = open(os.path.join(self.root, self.shard), "wb")
+        offset = self.file.tell()
+        self.file.write(record)
+        self.file.flush()
+        self.index.write(json.dumps([name, self.shard, offset, len(record)], ensure_ascii=False) + "\n")
+        self.index.flush()
+
+    def close_shard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.close_shard()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class GraphReader(RecordReader):
+    """Table graphs of the index written by GraphWriter."""
+    record = TableGraph
+
+    def __init__(self, index_path : str):
+        root = os.path.dirname(os.path.abspath(index_path))
+        shards = {}
+        tables = {}
+        with open(index_path, "r", encoding = "utf-8") as f:
+            for line in f:
+                if line.endswith("\n"):
+                    # a table written again by a resumed run replaces the earlier entry
+                    name, shard, offset, size = json.loads(line)
+                    tables[name] = (shards.setdefault(shard, len(shards)), offset, size)
+        super().__init__([os.path.join(root, shard) for shard in shards], tables)
+
+
+def open_graphs(index_path : str):
+    return open_index(GraphReader, index_path)
+
+
+if __name__ == '__main__':
+    # python graph.py graphs/val part-00000.jsonl part-00001.jsonl ...
+    from writer import iter_annotations
+    with GraphWriter(sys.argv[1]) as graphs:
+        for anno in iter_annotations(sys.argv[2:]):
+            graphs.write(anno["id"], encode_graph(AnnotationColumns.from_documents(anno["document"])))
+    print(f"graphs indexed in {graphs.index_path}")
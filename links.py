@@ -0,0 +1,78 @@
+import numpy as np
+from typing import *
+
+
+class LinkStore(object):
+    """Sparse set of directed links between line ids.
+
+    Links are appended as (head, tail) pairs and frozen on demand into CSR
+    arrays (`indptr`, `indices`), deduplicated and sorted by tail within each
+    head, so exporting only touches the links that exist.
+    """
+
+    def __init__(self, size : int = 0):
+        self.size = size
+        self.heads = []
+        self.tails = []
+        self.csr = None
+
+    def add(self, head, tail):
+        # links to a line-less cell (id None) are dropped
+        if head is None or tail is None:
+            return
+        self.heads.append(int(head))
+        self.tails.append(int(tail))
+        self.csr = None
+
+    def add_many(self, heads, tails):
+        # array version of add; negative ids stand for line-less cells
+        heads = np.asarray(heads, dtype = np.int64)
+        tails = np.asarray(tails, dtype = np.int64)
+        keep = (heads >= 0) & (tails >= 0)
+        self.heads.extend(heads[keep].tolist())
+        self.tails.extend(tails[keep].tolist())
+        self.csr = None
+
+    def __len__(self):
+        indptr, _ = self.to_csr()
+        return int(indptr[-1])
+
+    def __contains__(self, link):
+        head, tail = link
+        return int(tail) in self.get(head)
+
+    def to_csr(self):
+        if self.csr is None:
+            heads = np.array(self.heads, dtype = np.int64)
+            tails = np.array(self.tails, dtype = np.int64)
+            size = max([self.size, int(heads.max()) + 1 if len(heads) else 0, int(tails.max()) + 1 if len(tails) else 0])
+            keys = np.unique(heads * size + tails)
+            heads, tails = keys // size, keys % size
+            indptr = np.zeros(size + 1, dtype = np.int64)
+            np.cumsum(np.bincount(heads, minlength = size), out = indptr[1:])
+            self.csr = (indptr, tails)
+        return self.csr
+
+    def get(self, head):
+        indptr, indices = self.to_csr()
+        if head is None or head < 0 or head + 1 >= len(indptr):
+            return []
+        return indices[indptr[head]:indptr[head + 1]].tolist()
+
+    @property
+    def edges(self):
+        indptr, indices = self.to_csr()
+        heads = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return list(zip(heads.tolist(), indices.tolist()))
+
+    def rows(self, heads):
+        # links of many heads at once: (position in heads, tail), grouped by position
+        indptr, indices = self.to_csr()
+        heads = np.asarray(heads, dtype = np.int64)
+        valid = (heads >= 0) & (heads + 1 < len(indptr))
+        safe = np.where(valid, heads, 0)
+        start = indptr[safe]
+        count = np.where(valid, indptr[np.minimum(safe + 1, len(indptr) - 1)] - start, 0)
+        owner = np.repeat(np.arange(len(heads)), count)
+        tails = indices[np.repeat(start - np.cumsum(count) + count, count) + np.arange(len(owner))]
+        return owner, tails
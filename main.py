@@ -1,28 +1,33 @@
 from typing import *
 import numpy as np
-from utils import is_overlap, with_line, Box, read_ocr, read_file, draw_rectangle, get_color, draw_arrow
+from utils import is_overlap, with_line, Box, Words, read_ocr, read_file, draw_rectangle, get_color, draw_arrow, boxes_to_array, overlap_matrix, read_image_size
+from spatial import WordIndex, assign_to_grid
+from links import LinkStore
+from rules import CellGrid, header_cells, links_in_row, links_in_cell, links_to_header, links_to_projected
+from cluster import cluster_by_center, chain_lines
+from writer import AnnotationWriter, assemble
+from checkpoint import Checkpoint
+from export import AnnotationColumns, encode_table
+from graph import GraphWriter, encode_graph
+from cache import open_cache, file_digest
+from pipeline import prefetch, BackgroundWriter
+from profiling import StageTimer, NULL_TIMER, Profile
+from render import visualize, sampled
+from shards import open_reader
 import tqdm
 import json
 import os
+import cv2
+import argparse
+import multiprocessing
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 ROOT_IMG = "images_table"
 ROOT_LABEL = "labels_table"
 ROOT_OCR = "ocr_labels"
-IDX = 0
-
-class Box(object):
-
-    def __init__(self, bbox : List):
-        self.xmin = bbox[0]
-        self.ymin = bbox[1]
-        self.xmax = bbox[2]
-        self.ymax = bbox[3]
-        self.xcenter = (self.xmin + self.xmax) / 2
-        self.ycenter = (self.ymin + self.ymax) / 2
-
-    def get_box(self):
-        return [self.xmin, self.ymin, self.xmax, self.ymax]
-
+# part of every result cache key: bump it when the Table rules or the annotation schema change
+RULES_VERSION = "1"
 
 class RelativeBox(object):
 
@@ -65,24 +70,9 @@ def stitch_boxes_into_lines(boxes, max_x_dist = 10, min_y_overlap_ratio=0.8):
         return []
     merged_boxes = []
     x_sorted_boxes = sorted(list(boxes.values()), key=lambda x: x['box'].xmin)
-    skip_idx = set()
-
-    i = 0
-
-    for i in range(len(x_sorted_boxes)):
-        if i in skip_idx:
-            continue
-        
-        rightmost_box_idx = i
-        line = [rightmost_box_idx]
+    same_line = lambda box_a, box_b : is_on_same_line(box_a, box_b, min_y_overlap_ratio)
 
-        for j in range(i + 1, len(x_sorted_boxes)):
-            for j in skip_idx:
-                continue
-            if is_on_same_line(x_sorted_boxes[rightmost_box_idx]['box'], x_sorted_boxes[j]['box'], min_y_overlap_ratio):
-                line.append(j)
-                skip_idx.add(j)
-                rightmost_box_idx = j
+    for line in chain_lines([x['box'] for x in x_sorted_boxes], same_line, [[x['box'].ymin, x['box'].ymax] for x in x_sorted_boxes]):
         lines = []
         line_idx = 0
         lines.append([line[0]])
@@ -117,10 +107,22 @@ def stitch_boxes_into_lines(boxes, max_x_dist = 10, min_y_overlap_ratio=0.8):
             
 
 
+class IdAllocator(object):
+    # hands out line ids of one table in creation order
+
+    def __init__(self, start : int = 0):
+        self.count = start
+
+    def next(self) -> int:
+        idx = self.count
+        self.count += 1
+        return idx
+
+
 class TextBox(object):
 
-    def __init__(self, texts : List, idx : int):
-        self.lines = self.get_line(texts, idx)
+    def __init__(self, texts : List, ids : IdAllocator):
+        self.lines = self.get_line(texts, ids)
         if len(self.lines) == 0:
             self.id = None
             self.relative_id = []
@@ -128,30 +130,20 @@ class TextBox(object):
             self.id = self.lines['line-0']['id']
             self.relative_id = [self.lines[key]['id'] for key in self.lines if key != "line-0"]
 
-    def get_line(self, texts : List, idx : int) -> Dict:
+    def get_line(self, texts : List, ids : IdAllocator) -> Dict:
         lines = {}
-        global IDX
         if len(texts) == 0:
             return lines
         else:
             # print(texts)
-            texts = {k : v for k, v in sorted(texts.items(), key=lambda x : x[1]['box'].xmin)}
-            box_lines = []
-            set_idx = set()
-            for i in texts:
-                if i in set_idx:
-                    continue
-                line = [texts[i]]
-                set_idx.add(i)
-                for j in texts:
-                    if j in set_idx:
-                        continue
-                    if with_line(texts[i]['box'], texts[j]['box']):
-                        line.append(texts[j])
-                        set_idx.add(j)
-                box_lines.append(line)
+            keys = list(texts.keys())
+            texts = list(texts.values())
+            order = sorted(range(len(texts)), key = lambda i : texts[i]['box'].xmin)
+            box_lines = cluster_by_center([i['box'].ycenter for i in texts], order, tolerance = 5)
             for idx, line in enumerate(box_lines):
-                line = sorted(line, key = lambda x : x['box'].xmin)
+                # keys of the words the line is made of, in word order
+                words = sorted(keys[i] for i in line)
+                line = [texts[i] for i in line]
                 xmin = min([i['box'].xmin for i in line])
                 xmax = max([i['box'].xmax for i in line])
                 ymin = min([i['box'].ymin for i in line])
@@ -160,19 +152,19 @@ class TextBox(object):
                 lines[f'line-{idx}'] = {
                     "text" : text,
                     "box" : Box([xmin, ymin, xmax, ymax]),
-                    "id" : IDX
+                    "id" : ids.next(),
+                    "words" : words
                 }
-                IDX += 1
             return lines
 
     
 class Cell(object):
 
-    def __init__(self, relative_position, boudingbox, text, idx, type, text_id):
+    def __init__(self, relative_position, boudingbox, text, idx, type, ids):
 
         self.RBox = RelativeBox(relative_position)
         self.BBox = Box(boudingbox)
-        self.TBox = TextBox(text, text_id)
+        self.TBox = TextBox(text, ids)
         self.idx = idx
         self.type = type
 
@@ -181,8 +173,9 @@ class Table(object):
 
     def __init__(self, boxes_text, boxes_element):
         self.boxes_text = boxes_text
-        self.boxes_element = boxes_element
-        global IDX
+        self.boxes, self.labels = boxes_element
+        self.ids = IdAllocator()
+        self.word_index = WordIndex.from_words(boxes_text)
         self.label = {
             0 : "table",
             1 : "table_column",
@@ -191,69 +184,60 @@ class Table(object):
             4 : "table_projected_row_header",
             5 : "table_spanning_cell"
         }
+        self.boxes_element = list(zip(self.boxes, [self.label[label] for label in self.labels.tolist()]))
         self.metadata, self.header, self.table = self.__get_metadata()
-        self.matrix = np.zeros(shape = (IDX + 1, IDX + 1))
+        # integer arrays of the cells the linking rules run on
+        self.grid = CellGrid.from_cells(self.metadata)
+        self.links = LinkStore(self.ids.count + 1)
 
 
     def get_box_text_in(self, box):
-        result = {}
-        for key, value in self.boxes_text.items():
-            if is_overlap(value['box'], box, threshold = 0.80):
-                result[key] = value
-        return result
+        return self.word_index.select(self.boxes_text, box, threshold = 0.80)
 
     def __get_metadata(self):
-        xmins = []
-        ymins = []
-        for box, label in self.boxes_element:
-            if label in ['table_row', 'table_column']:
-                xmins.append(int(box.xmin))
-                ymins.append(int(box.ymin))
-                xmins.append(int(box.xmax))
-                ymins.append(int(box.ymax))
-
-        cols = { x : idx for idx, x in enumerate(sorted(list(set(xmins))))}
-        rows = { y : idx for idx, y in enumerate(sorted(list(set(ymins))))}
-
-        cells = []
-        for box_row, label_row in self.boxes_element:
-            if label_row == "table_row":
-                for box_col, label_col in self.boxes_element:
-                    if label_col == "table_column":
-                        cells.append(Box([box_col.xmin, box_row.ymin, box_col.xmax, box_row.ymax]))
-        idx = 0
+        coords = self.boxes.coords
+        row_boxes = coords[self.labels == 2]
+        col_boxes = coords[self.labels == 1]
+        # grid lines: the (truncated) edges of all rows and columns
+        lines = np.concatenate([row_boxes, col_boxes]).astype(np.int64)
+        xs = np.unique(lines[:, [0, 2]])
+        ys = np.unique(lines[:, [1, 3]])
+        cols = { x : idx for idx, x in enumerate(xs.tolist())}
+        rows = { y : idx for idx, y in enumerate(ys.tolist())}
+
+        # rows x columns cell boxes, row major in label order
+        num_rows, num_cols = len(row_boxes), len(col_boxes)
+        cells = np.empty((num_rows * num_cols, 4), dtype = np.float64)
+        cells[:, 0] = np.tile(col_boxes[:, 0], num_rows)
+        cells[:, 1] = np.repeat(row_boxes[:, 1], num_cols)
+        cells[:, 2] = np.tile(col_boxes[:, 2], num_rows)
+        cells[:, 3] = np.repeat(row_boxes[:, 3], num_cols)
+        spans = coords[(self.labels == 4) | (self.labels == 5)]
+        keep = np.flatnonzero(~(overlap_matrix(spans, cells) >= 0.85).any(axis = 0))
+        cells = cells[keep]
+        grid = cells.astype(np.int64)
+        relative = np.stack([
+            np.searchsorted(ys, grid[:, 1]), np.searchsorted(ys, grid[:, 3]),
+            np.searchsorted(xs, grid[:, 0]), np.searchsorted(xs, grid[:, 2])
+        ], axis = 1)
+
+        # words of every kept cell in one pass over the row / column bands
+        words = assign_to_grid(self.word_index.boxes, cells, keep // num_cols, keep % num_cols, 0.80, self.word_index.mode)
+
         metadata = []
         header = []
         table = None
-        text_id = 0
-        for cell in cells:
-            flag = True
-            for box, label in self.boxes_element:
-                if label in ['table_projected_row_header', 'table_spanning_cell']:
-                    if is_overlap(box, cell, threshold = 0.85):
-                        flag = False
-                        break
-            if flag:
-                re = [rows[int(cell.ymin)], rows[int(cell.ymax)], cols[int(cell.xmin)], cols[int(cell.xmax)]]
-                texts = self.get_box_text_in(cell)
-                obj = Cell(re, [cell.xmin, cell.ymin, cell.xmax, cell.ymax], texts, idx, 'cell', text_id)
-                metadata.append(obj)
-                if len(obj.TBox.relative_id) > 0:
-                    text_id = max(obj.TBox.relative_id)
-                elif obj.TBox.id is not None:
-                    text_id = obj.TBox.id
-                idx += 1
-        
+        for idx, (re, cell, positions) in enumerate(zip(relative.tolist(), cells.tolist(), words)):
+            texts = self.word_index.pick(self.boxes_text, positions)
+            metadata.append(Cell(re, cell, texts, idx, 'cell', self.ids))
+        idx = len(metadata)
+
         for box, label in self.boxes_element:
             if label in ['table_projected_row_header', 'table_spanning_cell']:
                 re = [rows[int(box.ymin)], rows[int(box.ymax)], cols[int(box.xmin)], cols[int(box.xmax)]]
                 texts = self.get_box_text_in(box)
-                obj = Cell(re, [box.xmin, box.ymin, box.xmax, box.ymax], texts, idx, label, text_id)
+                obj = Cell(re, [box.xmin, box.ymin, box.xmax, box.ymax], texts, idx, label, self.ids)
                 metadata.append(obj)
-                if len(obj.TBox.relative_id) > 0:
-                    text_id = max(obj.TBox.relative_id)
-                elif obj.TBox.id is not None:
-                    text_id = obj.TBox.id
             
             if label in ['table_column_header']:
                 re = [rows[int(box.ymin)], rows[int(box.ymax)], cols[int(box.xmin)], cols[int(box.xmax)]]
@@ -268,98 +252,34 @@ class Table(object):
 
 
     def get_id_header(self):
-        list_header = []
+        # positions in self.grid of the header cells
         if len(self.header) == 0:
-            return list_header
+            return np.zeros(0, dtype = np.int64)
         elif len(self.header) == 1:
-            num_lines = self.header[0].row_end - self.header[0].row_start
-            if num_lines == 1:
-                for cell in self.metadata:
-                    if (cell.RBox.row_start == self.header[0].row_start) and (cell.RBox.row_end == self.header[0].row_end) and cell.type == 'cell' and cell.TBox.id is not None:
-                        list_header.append(cell)
-                return list_header
-            elif num_lines == 2:
-                s = 0
-                selected = []
-                for cell in self.metadata:
-                    if cell.type == 'table_spanning_cell' and cell.RBox.row_start == self.header[0].row_start:
-                        s += cell.RBox.num_grid
-                        selected.append(cell)
-                if s == self.header[0].num_grid:
-                    for cell in selected:
-                        if cell.TBox.id is not None:
-                            list_header.append(cell)
-                else:
-                    for cell in selected:
-                        if cell.RBox.num_row == self.header[0].num_row and cell.TBox.id is not None:
-                            list_header.append(cell)
-                        else:
-                            for c in self.metadata:
-                                if c.type == 'cell' and c.RBox.row_start == cell.RBox.row_end and c.RBox.col_start >= cell.RBox.col_start and c.RBox.col_end <= cell.RBox.col_end and c.TBox.id is not None:
-                                    list_header.append(c)
-                                    self.matrix[c.TBox.id][cell.TBox.id] = 1
-                return list_header
-  
+            header = self.header[0]
+            if header.num_row in (1, 2):
+                found, heads, tails = header_cells(self.grid, (header.row_start, header.row_end, header.col_start, header.col_end))
+                self.links.add_many(heads, tails)
+                return found
             else:
-                raise "Only supported two-one line header"
+                raise TypeError("Only supported two-one line header")
         else:
-            raise "Only supported one header"
+            raise TypeError("Only supported one header")
 
     def create_link_in_row(self):
         row_end_header = 0
         if len(self.header) == 1:
             row_end_header = self.header[0].row_end
-        for cell_1 in self.metadata:
-            if cell_1.type == 'cell' and cell_1.RBox.row_end > row_end_header:
-            # if cell_1.type == 'cell':
-                for cell_2 in self.metadata:
-                    if cell_2.type == 'cell' and cell_1.RBox.row_start == cell_2.RBox.row_start and cell_1.RBox.row_end == cell_2.RBox.row_end:
-                        if cell_1.TBox.id is not None and cell_2.TBox.id is not None and cell_1.TBox.id != cell_2.TBox.id:
-                            self.matrix[cell_1.TBox.id][cell_2.TBox.id] = 1
-                            self.matrix[cell_2.TBox.id][cell_1.TBox.id] = 1
+        self.links.add_many(*links_in_row(self.grid, row_end_header))
 
-    
     def create_link_cell_with_header(self):
-        lst_header = self.get_id_header()
-        if len(lst_header) > 0:
-            for header in lst_header:
-                for cell in self.metadata:
-                    if cell.type == 'cell' and cell.RBox.col_start == header.RBox.col_start and cell.RBox.col_end == header.RBox.col_end:
-                        if cell.TBox.id is not None:
-                            self.matrix[cell.TBox.id][header.TBox.id] = 1
+        self.links.add_many(*links_to_header(self.grid, self.get_id_header()))
 
-    
     def create_link_cell_to_project(self):
-        lst_projected = []
-        for cell in self.metadata:
-            if cell.type == 'table_projected_row_header':
-                lst_projected.append(cell)
-        if len(lst_projected):
-            lst_projected = sorted(lst_projected, key=lambda x:x.RBox.row_start)
-            if len(lst_projected) == 1:
-                for cell in self.metadata:
-                    if cell.type == 'cell' and cell.RBox.col_start == lst_projected[0].RBox.col_start and cell.RBox.row_start >= lst_projected[0].RBox.row_end and cell.RBox.col_end == 1:
-                        if cell.TBox.id is not None:
-                            self.matrix[cell.TBox.id][lst_projected[0].TBox.id] = 1
-            else:
-                for idx, projected in enumerate(lst_projected[:-1]):
-                    start = projected.RBox.row_end
-                    end = lst_projected[idx + 1].RBox.row_start
-                    for cell in self.metadata:
-                        if cell.type == 'cell' and cell.RBox.col_start == projected.RBox.col_start and cell.RBox.row_start >= start and cell.RBox.row_end > end and cell.RBox.col_end == 1:
-                            if cell.TBox.id is not None:
-                                self.matrix[cell.TBox.id][projected.TBox.id] = 1
-
-                for cell in self.metadata:
-                    if cell.type == 'cell' and cell.RBox.col_start == lst_projected[-1].RBox.col_start and cell.RBox.row_start >= lst_projected[-1].RBox.row_end and cell.RBox.col_end == 1:
-                        if cell.TBox.id is not None:
-                            self.matrix[cell.TBox.id][lst_projected[-1].TBox.id] = 1
+        self.links.add_many(*links_to_projected(self.grid))
 
     def create_link_in_cell(self):
-        for cell in self.metadata:
-            if len(cell.TBox.lines) >= 2:
-                for i in cell.TBox.relative_id:
-                    self.matrix[cell.TBox.id][i] = 1
+        self.links.add_many(*links_in_cell(self.grid))
     
     def create_link(self):
         self.create_link_in_row()
@@ -367,142 +287,316 @@ class Table(object):
         self.create_link_cell_with_header()
         self.create_link_cell_to_project()
 
-def gen_annotations(table, ocrs):
-    documents = []
-    h, w = np.shape(table.matrix)[:2]
-    boxes_ocr = []
+def word_texts(words, keys):
+    if isinstance(words, Words):
+        return [words.texts[key] for key in keys]
+    return [words[key]['text'] for key in keys]
+
+def annotation_columns(table, ocrs):
+    # the annotation of a table as export.AnnotationColumns: its lines, then the words of no line
+    boxes = []
+    texts = []
+    ids = []
+    labels = []
+    words = []
     for item in table.metadata:
-        label = "answer"
+        label = 0
         if item.type != 'cell':
-            label = "question"
+            label = 1
         for i in item.TBox.lines.values():
-            boxes_ocr.append(
-                {
-                    'box' : Box([i['box'].xmin, i['box'].ymin, i['box'].xmax, i['box'].ymax]),
-                    'text' : i['text'],
-                    'id' : i['id'], 
-                    'label' : label
-                }
-            )
-    # print(boxes_ocr)
-    # 1/0
-    idx = 0
-    for ocr in boxes_ocr:
-        temp = {
-            "box" : [ocr['box'].xmin, ocr['box'].ymin, ocr['box'].xmax, ocr['box'].ymax],
-            "text" : ocr['text'],
-            "word" : [],
-            "id" : ocr['id'],
-            "label" : ocr['label'],
-            "linking" : []
-        }
-        for i in range(w):
-            if table.matrix[ocr['id']][i] == 1:
-                if ocr['id'] != i:
-                    temp['linking'].append([ocr['id'], i])
-        for ocr_ in ocrs.values():
-            if is_overlap(ocr['box'], ocr_['box'], threshold = 0.7):
-                temp['word'].append(
-                    {
-                        "box" : [ocr_['box'].xmin, ocr_['box'].ymin, ocr_['box'].xmax, ocr_['box'].ymax], 
-                        "text" : ocr_['text'],
-                    }
-                )
-        documents.append(temp)
-        idx = ocr['id']
-    
-    for ocr in ocrs.values():
-        if not is_overlap(ocr['box'], table.table, threshold = 0.1):
-            idx += 1
-            temp = {
-                        "box" : [ocr['box'].xmin, ocr['box'].ymin, ocr['box'].xmax, ocr['box'].ymax],
-                        "text" : ocr['text'],
-                        "word" : [
-                            {
-                                "box" : [ocr['box'].xmin, ocr['box'].ymin, ocr['box'].xmax, ocr['box'].ymax], 
-                                "text" : ocr['text'],
-                            }
-                        ],
-                        "id" : idx,
-                        "label" : "other",
-                        "linking" : []
-                    }
-            documents.append(temp)
-
-    return documents
-
-
-def visualize(image, annotation):
-    for doc in annotation:
-        color = get_color()
-        box_1 = doc['box']
-        linking = doc['linking']
-        if len(linking) > 0:
-            for link in linking:
-                i = link[1]
-                for doc_2 in annotation:
-                    if int(doc_2['id']) == int(i):
-                        box_2 = doc_2['box']
-                        image = draw_rectangle(image, box_1, color)
-                        image = draw_rectangle(image, box_2, color)
-                        draw_arrow(image, box_1, box_2, color)
-    return image
-
-def run(name, idx):
-    # print(name)
-    global IDX
-    IDX = 0
+            boxes.append([i['box'].xmin, i['box'].ymin, i['box'].xmax, i['box'].ymax])
+            texts.append(i['text'])
+            ids.append(i['id'])
+            labels.append(label)
+            words.append(i['words'])
+
+    # line words come from the table's own words (the ones the lines were built from)
+    word_index = table.word_index
+    position = {key : j for j, key in enumerate(word_index.keys)}
+    word_keys = [key for w in words for key in w]
+    word_line = np.repeat(np.arange(len(words)), [len(w) for w in words])
+    word_pos = np.array([position[key] for key in word_keys], dtype = np.int64)
+
+    # links of every line, self links dropped
+    line_ids = np.array(ids, dtype = np.int64)
+    edge_line, tails = table.links.rows(line_ids)
+    heads = line_ids[edge_line]
+    own = heads != tails
+    edge_line, edges = edge_line[own], np.stack([heads[own], tails[own]], axis = 1)
+
+    idx = ids[-1] if len(ids) > 0 else 0
+    other_index = word_index if ocrs is table.boxes_text else WordIndex.from_words(ocrs)
+    # every word no line was built from becomes an "other" line: the words outside
+    # the table, but also the ones inside it that no cell took (e.g. across a cell edge)
+    claimed = set(word_keys)
+    other = np.flatnonzero([key not in claimed for key in other_index.keys])
+    other_texts = word_texts(ocrs, [other_index.keys[j] for j in other.tolist()])
+    num_lines = len(ids)
+    return AnnotationColumns(
+        boxes = np.concatenate([np.array(boxes, dtype = np.float64).reshape(-1, 4), other_index.boxes[other]]),
+        texts = texts + other_texts,
+        ids = np.concatenate([line_ids, idx + 1 + np.arange(len(other))]),
+        labels = np.concatenate([np.array(labels, dtype = np.int8), np.full(len(other), 2, dtype = np.int8)]),
+        word_line = np.concatenate([word_line, num_lines + np.arange(len(other))]),
+        word_boxes = np.concatenate([word_index.boxes[word_pos], other_index.boxes[other]]),
+        word_texts = word_texts(table.boxes_text, word_keys) + other_texts,
+        edge_line = edge_line,
+        edges = edges
+    )
+
+def gen_annotations(table, ocrs):
+    return annotation_columns(table, ocrs).to_documents()
+
+
+def load(name, *, timer = NULL_TIMER, ocr_cache = None, shards = None, result_cache = None):
+    # the I/O half of run: reads the inputs of a table, or on a result cache hit only its document
     image_path = os.path.join(ROOT_IMG, name + ".jpg")
     label_path = os.path.join(ROOT_LABEL, name + ".txt")
     ocr_path = os.path.join(ROOT_OCR, name + "_words.json")
 
-    image = cv2.imread(image_path)
-    boxes_element, h, w = read_file(label_path)
-    boxes_text = read_ocr(ocr_path, h, w)
-
-    table = Table(boxes_text, boxes_element)
-    table.create_link()
-    anno = gen_annotations(table, boxes_text)
+    # with shards (an index written by shards.py) the table is read from the packed shard files
+    record = open_reader(shards).get(name) if shards is not None else None
+    inputs = {"record" : record, "key" : None, "document" : None}
+    # with result_cache (a directory) a table whose inputs and rules are unchanged is not rebuilt
+    cache = open_cache(result_cache, RULES_VERSION) if result_cache is not None else None
+    if cache is not None:
+        if record is not None:
+            inputs["key"] = cache.key(record.content)
+        else:
+            inputs["key"] = cache.key(file_digest(label_path), file_digest(ocr_path), "%dx%d" % read_image_size(image_path))
+        inputs["document"] = cache.get(inputs["key"])
+        timer.mark("cache")
+        timer.count("cached", inputs["document"] is not None)
+        if inputs["document"] is not None:
+            return inputs
+
+    if record is not None:
+        boxes_element, h, w = record.read_file()
+        timer.mark("read_file")
+        boxes_text = record.read_ocr()
+        timer.mark("read_ocr")
+    else:
+        boxes_element, h, w = read_file(label_path)
+        timer.mark("read_file")
+        boxes_text = read_ocr(ocr_path, h, w, ocr_cache)
+        timer.mark("read_ocr")
+    inputs["boxes_element"] = boxes_element
+    inputs["boxes_text"] = boxes_text
+    return inputs
+
+def process(name, inputs, *, visual = False, timer = NULL_TIMER, encoded = False, result_cache = None, graph = False):
+    # the compute half of run, on the inputs from load; with graph it returns (anno, graph.encode_graph record)
+    timer.restart()
+    record = inputs["record"]
+    document = inputs["document"]
+    columns = None
+    if document is None:
+        boxes_text = inputs["boxes_text"]
+        table = Table(boxes_text, inputs["boxes_element"])
+        timer.mark("table")
+        table.create_link()
+        timer.mark("create_link")
+        columns = annotation_columns(table, boxes_text)
+        timer.mark("gen_annotations")
+        if timer is not NULL_TIMER:
+            timer.count("words", len(boxes_text))
+            timer.count("cells", len(table.metadata))
+            timer.count("lines", len(columns))
+            timer.count("links", len(table.links))
+        if result_cache is not None:
+            document = columns.encode_document()
+            open_cache(result_cache, RULES_VERSION).put(inputs["key"], document)
+            timer.mark("encode")
     # print(anno)
 
-    image = visualize(image, anno)
-    cv2.imwrite(os.path.join("visualize", name + ".jpg"), image)
-    temp = {
-        "id" : name,
-        "document" : anno
-        # "image" : name
-    }     
+    anno = None
+    if visual:
+        anno = columns.to_documents() if columns is not None else json.loads(document)
+        image = record.read_image() if record is not None else None
+        if image is None:
+            image = cv2.imread(os.path.join(ROOT_IMG, name + ".jpg"))
+        timer.mark("imread")
+        image = visualize(image, anno)
+        timer.mark("visualize")
+        cv2.imwrite(os.path.join("visualize", name + ".jpg"), image)
+        timer.mark("imwrite")
+    # encoded: the JSON line of the table, serialized from the columns without building the dicts
+    if encoded:
+        temp = encode_table(name, document if document is not None else columns.encode_document())
+        timer.mark("encode")
+    else:
+        if anno is None:
+            anno = columns.to_documents() if columns is not None else json.loads(document)
+        temp = {
+            "id" : name,
+            "document" : anno
+            # "image" : name
+        }
+    if graph:
+        if columns is None:
+            columns = AnnotationColumns.from_documents(anno if anno is not None else json.loads(document))
+        temp = (temp, encode_graph(columns))
+        timer.mark("graph")
     return temp
 
+def run(name, idx, *, visual = False, timer = NULL_TIMER, ocr_cache = None, shards = None, encoded = False, result_cache = None, graph = False):
+    # print(name)
+    inputs = load(name, timer = timer, ocr_cache = ocr_cache, shards = shards, result_cache = result_cache)
+    return process(name, inputs, visual = visual, timer = timer, encoded = encoded, result_cache = result_cache, graph = graph)
+
+
+def run_task(task, *, profile = False, visual_rate = 0.0, ocr_cache = None, shards = None, encoded = False, result_cache = None, graph = False):
+    # returns (name, anno, err, timings); timings is None unless profile is set, anno a JSON string if encoded
+    idx, name = task
+    timer = StageTimer() if profile else NULL_TIMER
+    try:
+        anno = run(name, idx, visual = sampled(name, visual_rate), timer = timer, ocr_cache = ocr_cache, shards = shards, encoded = encoded,
+                   result_cache = result_cache, graph = graph)
+        return name, anno, None, timer.result()
+    except Exception as err:
+        return name, None, str(err), timer.result()
+
+def run_pipelined(tasks, *, depth = 8, threads = 4, profile = False, visual_rate = 0.0, ocr_cache = None, shards = None, encoded = False, result_cache = None,
+                  graph = False):
+    # like run_task over tasks, but the inputs of the next `depth` tables are loaded on background threads
+    def load_task(task):
+        idx, name = task
+        timer = StageTimer() if profile else NULL_TIMER
+        try:
+            return timer, load(name, timer = timer, ocr_cache = ocr_cache, shards = shards, result_cache = result_cache), None
+        except Exception as err:
+            return timer, None, str(err)
+
+    for (idx, name), (timer, inputs, err) in zip(tasks, prefetch(tasks, load_task, depth, threads)):
+        if err is None:
+            try:
+                anno = process(name, inputs, visual = sampled(name, visual_rate), timer = timer, encoded = encoded, result_cache = result_cache, graph = graph)
+                yield name, anno, None, timer.result()
+                continue
+            except Exception as e:
+                err = str(e)
+        yield name, None, err, timer.result()
+
+def run_chunk(tasks, **kwargs):
+    return list(run_pipelined(tasks, **kwargs))
+
+def build(names, *, workers = 1, chunksize = 16, ordered = True, maxtasksperchild = None, executor = "process", profile = False, visual_rate = 0.0,
+          ocr_cache = None, shards = None, encoded = False, result_cache = None, prefetch_depth = 0, io_threads = 4, graph = False):
+    # yields (name, anno, err, timings) per table; with ordered = True the order is the one of names.
+    # visual_rate is the fraction of tables drawn to visualize/ (render.py can do it afterwards),
+    # ocr_cache a directory for parsed OCR files reused by later builds, shards the index of packed tables,
+    # result_cache a directory of finished documents (see cache.py). With prefetch_depth > 0 each
+    # worker (process or thread) loads that many tables ahead on io_threads threads while it computes.
+    # With graph each anno comes with the packed link graph of the table (see graph.py).
+    tasks = list(enumerate(names))
+    options = dict(profile = profile, visual_rate = visual_rate, ocr_cache = ocr_cache, shards = shards, encoded = encoded, result_cache = result_cache,
+                   graph = graph)
+    task = functools.partial(run_task, **options)
+    if prefetch_depth > 0:
+        if workers <= 1:
+            yield from run_pipelined(tasks, depth = prefetch_depth, threads = io_threads, **options)
+            return
+        chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+        chunk_task = functools.partial(run_chunk, depth = prefetch_depth, threads = io_threads, **options)
+        if executor == "thread":
+            with ThreadPoolExecutor(workers) as pool:
+                if ordered:
+                    results = pool.map(chunk_task, chunks)
+                else:
+                    results = (future.result() for future in as_completed([pool.submit(chunk_task, chunk) for chunk in chunks]))
+                for chunk in results:
+                    yield from chunk
+            return
+        with multiprocessing.Pool(workers, maxtasksperchild = maxtasksperchild) as pool:
+            results = pool.imap if ordered else pool.imap_unordered
+            for chunk in results(chunk_task, chunks):
+                yield from chunk
+        return
+    if workers <= 1:
+        for item in tasks:
+            yield task(item)
+        return
+    if executor == "thread":
+        with ThreadPoolExecutor(workers) as pool:
+            if ordered:
+                results = pool.map(task, tasks)
+            else:
+                results = (future.result() for future in as_completed([pool.submit(task, item) for item in tasks]))
+            for result in results:
+                yield result
+        return
+    with multiprocessing.Pool(workers, maxtasksperchild = maxtasksperchild) as pool:
+        results = pool.imap if ordered else pool.imap_unordered
+        for result in results(task, tasks, chunksize = chunksize):
+            yield result
 
 
 if __name__ == "__main__":
-    import cv2
-    names = [i.split(".")[0] for i in os.listdir(ROOT_IMG)]
-
-    annotations = {
-        "lang" : "vi",
-        "info" : {
-            "author" : "ThanThoai",
-            "version" : 1.0
-        },
-        "documents" : []
-    }
-
-    with open("log_30_3.txt", 'w') as wr:
-        for idx, name in tqdm.tqdm(enumerate(names[1800:])):
-            try:
-                anno = run(name, idx)
-                annotations['documents'].append(anno)
-            # 1/0
-            except Exception as err:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--chunksize", type = int, default = 16)
+    parser.add_argument("--unordered", action = "store_true")
+    parser.add_argument("--maxtasksperchild", type = int, default = None)
+    parser.add_argument("--executor", choices = ["process", "thread"], default = "process")
+    parser.add_argument("--output", default = "pubtable1m_entity_linking_v1_val.json")
+    parser.add_argument("--max-bytes", type = int, default = None)
+    parser.add_argument("--max-tables", type = int, default = None)
+    parser.add_argument("--no-legacy", action = "store_true")
+    parser.add_argument("--checkpoint", default = None)
+    parser.add_argument("--restart", action = "store_true")
+    parser.add_argument("--visual-rate", type = float, default = 0.0, help = "fraction of tables to draw into visualize/")
+    parser.add_argument("--ocr-cache", default = None, help = "directory to cache parsed OCR words in")
+    parser.add_argument("--shards", default = None, help = "index of packed shards (shards.py) to read tables from")
+    parser.add_argument("--result-cache", default = None, help = "directory of cached table documents, reused while inputs and RULES_VERSION are unchanged")
+    parser.add_argument("--result-cache-bytes", type = int, default = None, help = "evict least recently used cache entries beyond this size after the run")
+    parser.add_argument("--prefetch", type = int, default = 0, help = "tables whose inputs are loaded ahead per worker (0: off)")
+    parser.add_argument("--io-threads", type = int, default = 4)
+    parser.add_argument("--write-queue", type = int, default = 64, help = "finished tables buffered for the background writer")
+    parser.add_argument("--graph", action = "store_true", help = "also write the link graph of each table to <output stem>-*.graph shards (graph.py)")
+    parser.add_argument("--profile", default = None, help = "write per-stage timing percentiles and histograms to this JSON file")
+    args = parser.parse_args()
+
+    if args.shards is not None:
+        names = open_reader(args.shards).names()
+    else:
+        names = [i.split(".")[0] for i in os.listdir(ROOT_IMG)]
+
+    # tables recorded in the checkpoint by an earlier interrupted run are skipped; a completed run removes it
+    stem = os.path.splitext(args.output)[0]
+    checkpoint = Checkpoint(args.checkpoint or stem + ".done", resume = not args.restart)
+    names = [name for name in names if name not in checkpoint]
+    results = build(names, workers = args.workers, chunksize = args.chunksize, ordered = not args.unordered, maxtasksperchild = args.maxtasksperchild,
+                    executor = args.executor, profile = args.profile is not None, visual_rate = args.visual_rate, ocr_cache = args.ocr_cache,
+                    shards = args.shards, encoded = True, result_cache = args.result_cache, prefetch_depth = args.prefetch,
+                    io_threads = args.io_threads, graph = args.graph)
+    profile = Profile()
+    stream = AnnotationWriter(stem + ".jsonl", args.max_bytes, args.max_tables, append = checkpoint.resumed)
+    graphs = GraphWriter(stem, append = checkpoint.resumed) if args.graph else None
+    with open("log_30_3.txt", 'a' if checkpoint.resumed else 'w') as wr, stream, checkpoint:
+        def record(result):
+            name, anno, err = result
+            if err is None:
+                if graphs is not None:
+                    anno, packed = anno
+                    graphs.write(name, packed)
+                stream.write_line(anno)
+                checkpoint.add(name)
+            else:
                 wr.write(f"{name}\t{err}")
                 print(err)
-        # 1/0
-    with open("pubtable1m_entity_linking_v1_val.json", 'w') as f:
-        json.dump(annotations, f, ensure_ascii=False)
-    
-
-
-
 
+        # output and checkpoint are written on a background thread, in result order
+        with BackgroundWriter(record, args.write_queue) as background:
+            for name, anno, err, timings in tqdm.tqdm(results, total = len(names)):
+                profile.add(name, timings)
+                background.put((name, anno, err))
+    if graphs is not None:
+        graphs.close()
+    if not args.no_legacy:
+        assemble(stream.paths, args.output, unique = checkpoint.resumed)
+    checkpoint.finish()
+    if args.result_cache is not None and args.result_cache_bytes is not None:
+        open_cache(args.result_cache, RULES_VERSION).evict(args.result_cache_bytes)
+    if args.profile is not None:
+        profile.write(args.profile)
+        print(profile.report())
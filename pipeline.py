@@ -0,0 +1,65 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+
+def prefetch(items : Iterable, load : Callable, depth : int = 8, threads : int = 4):
+    """Yields load(item) for every item, in order, while up to `depth` later
+    items are already being loaded on `threads` background threads."""
+    with ThreadPoolExecutor(max(1, threads)) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(load, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class BackgroundWriter(object):
+    """Calls `write(item)` for every `put` item on one background thread.
+
+    The queue holds at most `size` items, so a slow disk pushes back on the
+    producer instead of growing memory. An error in `write` stops the thread
+    and is raised again by the next `put` or by `close`.
+    """
+    STOP = object()
+
+    def __init__(self, write : Callable, size : int = 64):
+        self.write = write
+        self.queue = queue.Queue(max(1, size))
+        self.error = None
+        self.thread = threading.Thread(target = self.loop, daemon = True)
+        self.thread.start()
+
+    def loop(self):
+        while True:
+            item = self.queue.get()
+            if item is self.STOP:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.write(item)
+            except BaseException as err:
+                self.error = err
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,115 @@
+import time
+import json
+import numpy as np
+from typing import *
+
+# log-spaced bucket edges for the stage histograms, 10us .. 1000s
+TIME_BINS = np.logspace(-5, 3, 33)
+PERCENTILES = [50, 95, 99]
+
+
+class StageTimer(object):
+    """Per-table stage timings and counts.
+
+    `mark(stage)` charges the time since the previous mark (or creation) to
+    `stage`, so a run is timed with one perf_counter call per stage.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        self.last = time.perf_counter()
+
+    def mark(self, stage : str):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def restart(self):
+        # the time until now is not charged to any stage
+        self.last = time.perf_counter()
+
+    def count(self, key : str, value : int):
+        self.counts[key] = int(value)
+
+    def result(self):
+        return {"stages" : self.stages, "counts" : self.counts}
+
+
+class NullTimer(object):
+    # stands in for StageTimer when profiling is off
+
+    def mark(self, stage : str):
+        pass
+
+    def restart(self):
+        pass
+
+    def count(self, key : str, value : int):
+        pass
+
+    def result(self):
+        return None
+
+
+NULL_TIMER = NullTimer()
+
+
+def summarize(values, bins = None):
+    values = np.asarray(values, dtype = np.float64)
+    if len(values) == 0:
+        return {"n" : 0}
+    summary = {
+        "n" : int(len(values)),
+        "mean" : float(values.mean()),
+        "total" : float(values.sum()),
+        "min" : float(values.min()),
+        "max" : float(values.max())
+    }
+    for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{p}"] = float(value)
+    counts, edges = np.histogram(values, bins = bins if bins is not None else 20)
+    summary["histogram"] = {"edges" : edges.tolist(), "counts" : counts.tolist()}
+    return summary
+
+
+class Profile(object):
+    """Dataset-level aggregate of StageTimer results."""
+
+    def __init__(self, slowest : int = 10):
+        self.stages = {}
+        self.counts = {}
+        self.totals = []
+        self.slowest = slowest
+
+    def add(self, name : str, result : Dict):
+        if result is None:
+            return
+        for stage, value in result["stages"].items():
+            self.stages.setdefault(stage, []).append(value)
+        for key, value in result["counts"].items():
+            self.counts.setdefault(key, []).append(value)
+        self.totals.append((sum(result["stages"].values()), name))
+
+    def __len__(self):
+        return len(self.totals)
+
+    def summary(self):
+        return {
+            "tables" : len(self.totals),
+            "stages" : {stage : summarize(values, TIME_BINS) for stage, values in self.stages.items()},
+            "counts" : {key : summarize(values) for key, values in self.counts.items()},
+            "total" : summarize([t for t, _ in self.totals], TIME_BINS),
+            "slowest" : [[name, t] for t, name in sorted(self.totals, reverse = True)[:self.slowest]]
+        }
+
+    def write(self, path : str):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent = 2)
+
+    def report(self):
+        lines = []
+        for stage, values in self.stages.items():
+            p50, p95, p99 = np.percentile(values, PERCENTILES) * 1000
+            lines.append(f"{stage:16s} p50 {p50:9.2f}ms  p95 {p95:9.2f}ms  p99 {p99:9.2f}ms  total {sum(values):9.2f}s")
+        return "\n".join(lines)
@@ -0,0 +1,107 @@
+import os
+import glob
+import zlib
+import argparse
+import numpy as np
+import cv2
+import tqdm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+from utils import draw_rectangle, draw_arrow
+from writer import iter_annotations
+
+
+def sampled(name : str, rate : float):
+    # deterministic per table name, so reruns and any worker count pick the same tables
+    if rate <= 0:
+        return False
+    if rate >= 1:
+        return True
+    return zlib.crc32(name.encode("utf-8")) < rate * 2 ** 32
+
+def visualize(image, annotation, seed = None):
+    """Draws every link of `annotation` (one table's documents) onto image.
+
+    Each line with links gets one color and its box drawn once; link targets
+    are looked up by id instead of scanning the annotation per link.
+    """
+    by_id = {int(doc['id']) : doc for doc in annotation}
+    colors = np.random.default_rng(seed).integers(0, 256, size = (len(annotation), 3)).tolist()
+    for doc, color in zip(annotation, colors):
+        linking = doc['linking']
+        if len(linking) == 0:
+            continue
+        color = tuple(color)
+        box_1 = doc['box']
+        drawn = False
+        for link in linking:
+            doc_2 = by_id.get(int(link[1]))
+            if doc_2 is None:
+                continue
+            if not drawn:
+                image = draw_rectangle(image, box_1, color)
+                drawn = True
+            image = draw_rectangle(image, doc_2['box'], color)
+            draw_arrow(image, box_1, doc_2['box'], color)
+    return image
+
+def render(anno : Dict, root_img : str, out_dir : str, seed = None):
+    # anno is one {"id", "document"} record as written by main.py
+    image = cv2.imread(os.path.join(root_img, anno["id"] + ".jpg"))
+    if image is None:
+        raise FileNotFoundError(anno["id"])
+    return os.path.join(out_dir, anno["id"] + ".jpg"), visualize(image, anno["document"], seed)
+
+def render_all(annotations : Iterable[Dict], root_img : str, out_dir : str, workers : int = 4, rate : float = 1.0,
+               seed = None, max_pending : int = 64):
+    """Renders the sampled tables of `annotations` with a pool of workers.
+
+    Decoding and drawing run on `workers` threads (OpenCV releases the GIL),
+    encoding and writing on a second pool so they overlap with rendering. At
+    most `max_pending` tables are in flight. Yields (name, err) per table.
+    """
+    os.makedirs(out_dir, exist_ok = True)
+    with ThreadPoolExecutor(workers) as renderers, ThreadPoolExecutor(max(1, workers // 2)) as writers:
+        pending = deque()
+
+        def drain(limit):
+            while len(pending) > limit:
+                name, future = pending.popleft()
+                try:
+                    # a render future resolves to the future of its write
+                    if future.result().result():
+                        yield name, None
+                    else:
+                        yield name, "could not write image"
+                except Exception as err:
+                    yield name, str(err)
+
+        def job(anno):
+            path, image = render(anno, root_img, out_dir, seed)
+            return writers.submit(cv2.imwrite, path, image)
+
+        for anno in annotations:
+            if not sampled(anno["id"], rate):
+                continue
+            pending.append((anno["id"], renderers.submit(job, anno)))
+            yield from drain(max_pending)
+        yield from drain(0)
+
+
+if __name__ == '__main__':
+    # python render.py pubtable1m_entity_linking_v1_val.jsonl --rate 0.01
+    parser = argparse.ArgumentParser()
+    parser.add_argument("annotations", nargs = "+", help = "JSONL annotation files (or rolling parts) written by main.py")
+    parser.add_argument("--images", default = "images_table")
+    parser.add_argument("--output", default = "visualize")
+    parser.add_argument("--rate", type = float, default = 1.0)
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--seed", type = int, default = None)
+    args = parser.parse_args()
+
+    paths = sorted(p for pattern in args.annotations for p in glob.glob(pattern))
+    for name, err in tqdm.tqdm(render_all(iter_annotations(paths), args.images, args.output, args.workers, args.rate, args.seed)):
+        if err is not None:
+            print(name, err)
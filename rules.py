@@ -0,0 +1,132 @@
+import numpy as np
+from typing import *
+
+# cell type codes of CellGrid.type
+TYPES = {
+    "cell" : 0,
+    "table_projected_row_header" : 1,
+    "table_spanning_cell" : 2
+}
+CELL = TYPES["cell"]
+PROJECTED = TYPES["table_projected_row_header"]
+SPANNING = TYPES["table_spanning_cell"]
+
+
+def ranges(count):
+    # 0, 1, ..., count[i] - 1 for every i, concatenated
+    count = np.asarray(count, dtype = np.int64)
+    return np.arange(int(count.sum())) - np.repeat(np.cumsum(count) - count, count)
+
+def join(left, right):
+    # every (i, j) with left[i] == right[j], grouped by i
+    left = np.asarray(left, dtype = np.int64)
+    right = np.asarray(right, dtype = np.int64)
+    order = np.argsort(right, kind = "stable")
+    ordered = right[order]
+    lo = np.searchsorted(ordered, left, side = "left")
+    count = np.searchsorted(ordered, left, side = "right") - lo
+    i = np.repeat(np.arange(len(left)), count)
+    j = order[np.repeat(lo, count) + ranges(count)]
+    return i, j
+
+
+class CellGrid(object):
+    """Cells of one table as parallel int arrays, in metadata order.
+
+    `id` is the id of the cell's first line (-1 without lines) and `lines`
+    its number of lines; the lines of a cell have the consecutive ids
+    id, ..., id + lines - 1. Rule functions return (heads, tails) arrays.
+    """
+    __slots__ = ("row_start", "row_end", "col_start", "col_end", "type", "id", "lines", "size")
+
+    def __init__(self, spans, types, ids, lines):
+        spans = np.asarray(spans, dtype = np.int64).reshape(-1, 4)
+        self.row_start, self.row_end, self.col_start, self.col_end = spans.T.copy()
+        self.type = np.asarray(types, dtype = np.int8)
+        self.id = np.asarray(ids, dtype = np.int64)
+        self.lines = np.asarray(lines, dtype = np.int64)
+        # bound of every grid index, to pack (start, end) spans into one key
+        self.size = int(spans.max()) + 2 if len(spans) else 2
+
+    @classmethod
+    def from_cells(cls, cells : List):
+        spans = [(c.RBox.row_start, c.RBox.row_end, c.RBox.col_start, c.RBox.col_end) for c in cells]
+        types = [TYPES[c.type] for c in cells]
+        ids = [-1 if c.TBox.id is None else c.TBox.id for c in cells]
+        lines = [len(c.TBox.lines) for c in cells]
+        return cls(spans, types, ids, lines)
+
+    def __len__(self):
+        return len(self.id)
+
+    def key(self, start, end):
+        return np.asarray(start, dtype = np.int64) * self.size + end
+
+    def cells(self):
+        # positions of the 'cell' cells that have lines
+        return np.flatnonzero((self.type == CELL) & (self.id >= 0))
+
+
+def links_in_row(grid : CellGrid, header_end : int = 0):
+    # every two cells below the header sharing a row span, both ways
+    cells = grid.cells()
+    cells = cells[grid.row_end[cells] > header_end]
+    rows = grid.key(grid.row_start[cells], grid.row_end[cells])
+    i, j = join(rows, rows)
+    pair = i != j
+    return grid.id[cells[i[pair]]], grid.id[cells[j[pair]]]
+
+def links_in_cell(grid : CellGrid):
+    # the first line of a cell to each of its other lines
+    count = np.maximum(grid.lines - 1, 0)
+    heads = np.repeat(grid.id, count)
+    return heads, heads + ranges(count) + 1
+
+def header_cells(grid : CellGrid, header):
+    """Cells acting as headers of a one or two row column header span
+    (row_start, row_end, col_start, col_end). Returns their positions and
+    the links from the cells under a split spanning header to it."""
+    row_start, row_end, col_start, col_end = header
+    empty = np.zeros(0, dtype = np.int64)
+    if row_end - row_start == 1:
+        found = grid.cells()
+        found = found[(grid.row_start[found] == row_start) & (grid.row_end[found] == row_end)]
+        return found, empty, empty
+
+    spanning = np.flatnonzero((grid.type == SPANNING) & (grid.row_start == row_start))
+    num_grid = (grid.row_end - grid.row_start) * (grid.col_end - grid.col_start)
+    if num_grid[spanning].sum() == (row_end - row_start) * (col_end - col_start):
+        return spanning[grid.id[spanning] >= 0], empty, empty
+
+    # spanning cells as tall as the header are headers themselves, the others
+    # hand it down to the cells right under them and inside their columns
+    full = (grid.row_end[spanning] - grid.row_start[spanning] == row_end - row_start) & (grid.id[spanning] >= 0)
+    split = spanning[~full]
+    cells = grid.cells()
+    i, j = join(grid.row_end[split], grid.row_start[cells])
+    inside = (grid.col_start[cells[j]] >= grid.col_start[split[i]]) & (grid.col_end[cells[j]] <= grid.col_end[split[i]])
+    under, above = cells[j[inside]], split[i[inside]]
+    return np.concatenate([spanning[full], under]), grid.id[under], grid.id[above]
+
+def links_to_header(grid : CellGrid, headers):
+    # each cell to the headers with its column span
+    headers = np.asarray(headers, dtype = np.int64)
+    cells = grid.cells()
+    i, j = join(grid.key(grid.col_start[headers], grid.col_end[headers]), grid.key(grid.col_start[cells], grid.col_end[cells]))
+    return grid.id[cells[j]], grid.id[headers[i]]
+
+def links_to_projected(grid : CellGrid):
+    """Links the first column cells under each projected row header to it.
+
+    The cells of a header start below it and, but for the last header, end
+    below the start of the next one; only cells spanning (col_start, 1) of the
+    header are linked, as in the original rules.
+    """
+    projected = np.flatnonzero(grid.type == PROJECTED)
+    projected = projected[np.argsort(grid.row_start[projected], kind = "stable")]
+    end = np.full(len(projected), -1, dtype = np.int64)
+    end[:-1] = grid.row_start[projected[1:]]
+    cells = grid.cells()
+    i, j = join(grid.key(grid.col_start[projected], 1), grid.key(grid.col_start[cells], grid.col_end[cells]))
+    keep = (grid.row_start[cells[j]] >= grid.row_end[projected[i]]) & (grid.row_end[cells[j]] > end[i])
+    return grid.id[cells[j[keep]]], grid.id[projected[i[keep]]]
@@ -5,6 +5,10 @@ import json
 from typing import *
 import glob
 import tqdm
+from utils import read_image_size, Box, BoxArray, Words, load_words, polygons_to_xyxy, read_labels, yolo_to_boxes
+from spatial import WordIndex
+from links import LinkStore
+from cluster import cluster_by_center
 
 ROOT_IMG = "images_table"
 ROOT_LABEL = "labels_table"
@@ -30,23 +34,6 @@ for key, value in LIST_LABEL.items():
     _LIST_LABEL[value] = key
 
 
-class Box(object):
-
-    def __init__(self, bbox : List):
-        self.xmin = bbox[0]
-        self.ymin = bbox[1]
-        self.xmax = bbox[2]
-        self.ymax = bbox[3]
-        self.xcenter = (self.xmin + self.xmax) / 2
-        self.ycenter = (self.ymin + self.ymax) / 2
-
-    def get_box(self):
-        return [self.xmin, self.ymin, self.xmax, self.ymax]
-
-    def __rstr__(self):
-        return [self.xmin, self.ymin, self.xmax, self.ymax]
-
-
 def xywh2xyxy(box):
     x, y, w, h = box
     xmin = x - w / 2
@@ -58,32 +45,13 @@ def xywh2xyxy(box):
 
 def read_file(filename):
     img_path = filename.replace("labels", "images").split(".")[0] + ".jpg"
-    _, h_img, w_img = read_img(img_path)
-
-    with open(filename, "r") as f:
-        data = f.readlines()
-    result = []
-    for d in data:
-        d = d.strip().split(" ")
-        label = int(d[0])
-        xc = float(d[1]) * w_img
-        yc = float(d[2]) * h_img
-        wc = float(d[3]) * w_img
-        hc = float(d[4]) * h_img
-        result.append((Box(xywh2xyxy([xc, yc, wc, hc])), label))
-    return result
+    h_img, w_img = read_image_size(img_path)
+    classes, xywh = read_labels(filename)
+    return yolo_to_boxes(classes, xywh, h_img, w_img, clip = False)
 
-def read_ocr(filename):
-    with open(filename, 'r') as f:
-        data = json.load(f)['text']
-    result = {}
-    for idx, d in enumerate(data):
-        result[idx] = {
-            "bbox" : Box(bbox = getxyxy(d['bbox'])),
-            "text" : d['text'],
-            "id" : idx
-        }
-    return result
+def read_ocr(filename, cache_dir = None):
+    coords, texts = load_words(filename, cache_dir, key = 'text', to_xyxy = polygons_to_xyxy)
+    return Words(BoxArray.from_list(coords, clip = False), texts)
 
 def with_line(box1, box2, threshold = 5):
     if abs(box1.xcenter - box2.xcenter) <= threshold:
@@ -106,41 +74,32 @@ def is_overlap(box1, box2, threshold = 0.85):
         return True
     return False
 
-def get_box_text_in(box : Box, boxes : Dict):
-    result = {}
-    for idx in boxes.keys():
-        if is_overlap(boxes[idx]['bbox'], box, threshold = 0.9):
-            result[idx] = boxes[idx]
-    return result
+def get_box_text_in(box : Box, boxes : Dict, index : WordIndex = None):
+    if index is None:
+        index = WordIndex.from_words(boxes, mode = 'first')
+    return index.select(boxes, box, threshold = 0.9)
 
 
 def get_multiline(dict_box : Dict):
     result = {}
     idx = 0
-    dict_box = {k : v for k, v in sorted(dict_box.items(), key = lambda  x : x[1]['bbox'].xmin)}
+    dict_box = {k : v for k, v in sorted(dict_box.items(), key = lambda  x : x[1]['box'].xmin)}
     print(dict_box)
-    while len(dict_box) > 0:
-        lst_idx = list(map(int, dict_box.keys()))
-        lines = [lst_idx[0]]
-        for item in lst_idx[1:]:
-            if with_line(dict_box[lst_idx[0]]['bbox'], dict_box[item]['bbox']):
-                lines.append(item)
-        box_lines = [dict_box[i] for i in lines]
-        box_lines = sorted(box_lines, key = lambda x : x['bbox'].xmin)
-        for item in lines:
-            dict_box.pop(item)
+    values = list(dict_box.values())
+    for lines in cluster_by_center([v['box'].xcenter for v in values], tolerance = 5):
+        box_lines = [values[i] for i in lines]
         result[f"line-{idx}"] = box_lines
     return result
 
-def get_box_cell(metadata, boxes_text):
+def get_box_cell(metadata, boxes_text, index = None):
     metadata['cell'] = []
     for col in metadata['table_column']:
         box_col = col['box_item']
         for row in metadata['table_row']:
             box_row = row['box_item']
-            box_cell =Box([box_col.xmin, box_row.ymin, box_col.xmax, box_row.ymax])
+            box_cell = Box([box_col.xmin, box_row.ymin, box_col.xmax, box_row.ymax], clip = False)
 
-            text_in_cell = get_box_text_in(box_cell, boxes_text)
+            text_in_cell = get_box_text_in(box_cell, boxes_text, index)
             list_id = [i['id'] for i in text_in_cell.values()]
             metadata['cell'].append(
                 {
@@ -152,12 +111,13 @@ def get_box_cell(metadata, boxes_text):
     return metadata
 
 def get_metadata(boxes : List, boxes_text : Dict):
+    index = WordIndex.from_words(boxes_text, mode = 'first')
     metadata = {}
-    for box, label in boxes:
+    for box, label in zip(*boxes):
         if _LIST_LABEL[label] not in metadata:
             metadata[_LIST_LABEL[label]] = []
         
-        list_box_text = get_box_text_in(box,  boxes_text)
+        list_box_text = get_box_text_in(box,  boxes_text, index)
 
         metadata[_LIST_LABEL[label]].append(
             {
@@ -166,7 +126,7 @@ def get_metadata(boxes : List, boxes_text : Dict):
                 "list_id" : [list_box_text[i]['id'] for i in list_box_text.keys()]
             }
         )
-    metadata = get_box_cell(metadata, boxes_text)    
+    metadata = get_box_cell(metadata, boxes_text, index)    
     return metadata
 
 def get_header_column(metadata):
@@ -184,7 +144,7 @@ def get_header_column(metadata):
     print(list_id)
     return list_id
 
-def create_link_in_row(metadata, matrix):
+def create_link_in_row(metadata, links):
     list_header = get_header_column(metadata)
     for row in metadata['table_row']:
         box_row = row['box_item']
@@ -203,35 +163,29 @@ def create_link_in_row(metadata, matrix):
         list_id_row = row['list_id']
         for i1 in list_id_row:
             for i2 in list_id_row:
-                matrix[i1][i2] = 1
-                matrix[i2][i1] = 1
+                links.add(i1, i2)
+                links.add(i2, i1)
         for col in metadata['table_column']:
             list_id_col = col['list_id']
             idx_head = list(set(list_id_row) & set(list_id_col))
             idx_tail = list(set(list_id_col) & set(list_header))
             if len(idx_head) == 1 and len(idx_tail) == 1:
-                matrix[idx_head[0]][idx_tail[0]] = 1
-    return matrix
+                links.add(idx_head[0], idx_tail[0])
+    return links
 
             
 def cluster_box(list_box):
     result = {}
     idx = 0
     list_box = sorted(list_box, key = lambda  x : x['box_item'].xmin)
-    while len(list_box) > 0:
-        lines = [list_box[0]]
-        for item in list_box[1:]:
-            if with_line(lines[0]['box_item'], item['box_item']):
-                lines.append(item)
-        for l in lines:
-            list_box.remove(l)
-        lines = sorted(lines, key = lambda x : x['box_item'].xmin)
+    for lines in cluster_by_center([x['box_item'].xcenter for x in list_box], tolerance = 5):
+        lines = [list_box[i] for i in lines]
         result[f"cluster-{idx}"] = lines
     return result
 
 
 
-def create_link_in_header(metadata, matrix):
+def create_link_in_header(metadata, links):
     for header in metadata['table_column_header']:
         box_header = header['box_item']
         box_cells = []
@@ -244,7 +198,7 @@ def create_link_in_header(metadata, matrix):
         clusters = cluster_box(box_cells)
 
         if len(clusters) == 1:
-            return matrix
+            return links
         elif len(clusters) == 2:
             for span in metadata['table_spanning_cell']:
                 box_span = span['box_item']
@@ -256,13 +210,13 @@ def create_link_in_header(metadata, matrix):
                             cell_multiline = get_multiline(cell['list_box_text'])
                             cell_idx = int(cell_multiline['line-0'][0]['id'])
 
-                            matrix[span_idx][cell_idx] = 1
+                            links.add(span_idx, cell_idx)
             
-            return matrix
+            return links
         else:
             raise("Not supported !!!!!!!")
 
-def create_link_in_cell(metadata, matrix):
+def create_link_in_cell(metadata, links):
     for cell in metadata['cell']:
         cell_multiline = get_multiline(cell['list_box_text'])
         if len(cell_multiline) > 0:
@@ -275,8 +229,8 @@ def create_link_in_cell(metadata, matrix):
                 else:
                     for c in cell_multiline[key]:
                         tail_idx = c['id']
-                matrix[head_idx][tail_idx] = 1
-    return matrix
+                links.add(head_idx, tail_idx)
+    return links
 
 def getxyxy(box):
     bbox = []
@@ -288,21 +242,19 @@ def getxyxy(box):
     ymax = max(bbox[1::2])
     return [xmin, ymin, xmax, ymax]
 
-def gen_annotations(boxes_ocr, matrix):
+def gen_annotations(boxes_ocr, links):
     documents = []
-    h, w = np.shape(matrix)[:2]
     for ocr in boxes_ocr.values():
-        # print(ocr['bbox'])
+        # print(ocr['box'])
         temp = {
-            "box" : [ocr['bbox'].xmin, ocr['bbox'].ymin, ocr['bbox'].xmax, ocr['bbox'].ymax],
+            "box" : [ocr['box'].xmin, ocr['box'].ymin, ocr['box'].xmax, ocr['box'].ymax],
             "text" : ocr['text'],
             "word" : [],
             "id" : ocr['id'],
             "linking" : []
         }
-        for i in range(w):
-            if matrix[ocr['id']][i] == 1:
-                temp['linking'].append([ocr['id'], i])
+        for i in links.get(ocr['id']):
+            temp['linking'].append([ocr['id'], i])
         documents.append(temp)
     return documents
 
@@ -373,13 +325,13 @@ def run():
         boxes_ocr = read_ocr(ocr_path)
         boxes = read_file(label_yolo)
 
-        matrix = np.zeros(shape = (len(boxes_ocr), len(boxes_ocr)))
+        links = LinkStore(len(boxes_ocr))
         metadata = get_metadata(boxes, boxes_ocr)
-        matrix = create_link_in_row(metadata, matrix)
-        matrix = create_link_in_header(metadata, matrix)
-        matrix = create_link_in_cell(metadata, matrix)
+        links = create_link_in_row(metadata, links)
+        links = create_link_in_header(metadata, links)
+        links = create_link_in_cell(metadata, links)
 
-        anno = gen_annotations(boxes_ocr, matrix)
+        anno = gen_annotations(boxes_ocr, links)
         # print(anno)
         image = visualize(image, anno)
         cv2.imwrite(os.path.join("visualize", name + ".jpg"), image)
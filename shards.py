@@ -0,0 +1,191 @@
+import os
+import json
+import mmap
+import struct
+import argparse
+import functools
+import numpy as np
+import tqdm
+from typing import *
+
+from utils import read_image_size, load_words, read_labels, yolo_to_boxes, encode_texts, decode_texts, BoxArray, Words
+
+# one record per table, every section padded to 8 bytes so arrays can be viewed in place:
+# header (h, w, labels, words, text bytes, image bytes), label classes int64,
+# normalized label xywh float64 (n, 4), word coords float64 (n, 4),
+# word text offsets int64 (n + 1), utf-8 text blob, image bytes
+RECORD = struct.Struct("<6q")
+
+
+def pad(size : int):
+    return (size + 7) & ~7
+
+def encode_record(h : int, w : int, classes, xywh, coords, texts : List[str], image : bytes = b""):
+    offsets, blob = encode_texts(texts)
+    parts = [
+        RECORD.pack(h, w, len(classes), len(texts), len(blob), len(image)),
+        np.asarray(classes, dtype = "<i8").tobytes(),
+        np.ascontiguousarray(xywh, dtype = "<f8").tobytes(),
+        np.ascontiguousarray(coords, dtype = "<f8").reshape(-1, 4).tobytes(),
+        offsets.tobytes(),
+        blob + b"\0" * (pad(len(blob)) - len(blob)),
+        image + b"\0" * (pad(len(image)) - len(image))
+    ]
+    return b"".join(parts)
+
+
+class TableRecord(object):
+    """One packed table; the arrays are read-only views into the shard."""
+    __slots__ = ("name", "h", "w", "classes", "xywh", "coords", "offsets", "text", "image", "content")
+
+    def __init__(self, name : str, buffer, offset : int):
+        self.name = name
+        h, w, num_labels, num_words, text_size, image_size = RECORD.unpack_from(buffer, offset)
+        self.h, self.w = h, w
+        pos = offset + RECORD.size
+        self.classes = np.frombuffer(buffer, dtype = "<i8", count = num_labels, offset = pos)
+        pos += 8 * num_labels
+        self.xywh = np.frombuffer(buffer, dtype = "<f8", count = 4 * num_labels, offset = pos).reshape(num_labels, 4)
+        pos += 32 * num_labels
+        self.coords = np.frombuffer(buffer, dtype = "<f8", count = 4 * num_words, offset = pos).reshape(num_words, 4)
+        pos += 32 * num_words
+        self.offsets = np.frombuffer(buffer, dtype = "<i8", count = num_words + 1, offset = pos)
+        pos += 8 * (num_words + 1)
+        view = memoryview(buffer)
+        self.text = view[pos:pos + text_size]
+        pos += pad(text_size)
+        # the record without its image bytes, e.g. to hash the table inputs
+        self.content = view[offset:pos]
+        self.image = view[pos:pos + image_size] if image_size > 0 else None
+
+    @property
+    def texts(self):
+        return decode_texts(self.offsets, self.text)
+
+    def read_file(self):
+        # same result as utils.read_file on the label file
+        return yolo_to_boxes(self.classes, self.xywh, self.h, self.w), self.h, self.w
+
+    def read_ocr(self):
+        # same result as utils.read_ocr on the words file
+        return Words(BoxArray.from_list(self.coords, h = self.h, w = self.w), self.texts)
+
+    def read_image(self):
+        import cv2
+        if self.image is None:
+            return None
+        return cv2.imdecode(np.frombuffer(self.image, dtype = np.uint8), cv2.IMREAD_COLOR)
+
+
+class RecordReader(object):
+    """Records looked up by name in memory-mapped files.
+
+    `tables` maps a name to (file, offset, size) with `file` an index into
+    `paths`; files are mapped on first use and `get` builds a `record` class
+    instance over the mapped buffer, so its arrays are views, not copies.
+    """
+    record = None
+
+    def __init__(self, paths : List[str], tables : Dict):
+        self.paths = paths
+        self.tables = tables
+        self.maps = [None] * len(paths)
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def __len__(self):
+        return len(self.tables)
+
+    def names(self):
+        return list(self.tables.keys())
+
+    def buffer(self, shard : int):
+        if self.maps[shard] is None:
+            with open(self.paths[shard], "rb") as f:
+                self.maps[shard] = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        return self.maps[shard]
+
+    def get(self, name : str):
+        shard, offset, _ = self.tables[name]
+        return self.record(name, self.buffer(shard), offset)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+
+class ShardReader(RecordReader):
+    """Table records of the offset index written by `pack`."""
+    record = TableRecord
+
+    def __init__(self, index_path : str):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        root = os.path.dirname(os.path.abspath(index_path))
+        super().__init__([os.path.join(root, p) for p in index["shards"]], {name : tuple(entry) for name, entry in index["tables"].items()})
+
+
+@functools.lru_cache(maxsize = None)
+def open_index(reader : type, index_path : str):
+    # one reader (and one set of maps) per process and index
+    return reader(index_path)
+
+def open_reader(index_path : str):
+    return open_index(ShardReader, index_path)
+
+def pack(names : List[str], stem : str, root_img : str = "images_table", root_label : str = "labels_table",
+         root_ocr : str = "ocr_labels", images : bool = False, max_bytes : int = 1 << 30):
+    """Packs labels, OCR words, image size (and with `images` the jpg bytes)
+    of each table into `<stem>-00000.shard`, ... of about `max_bytes` each,
+    plus the offset index `<stem>.index.json`. Returns (index path, [(name, error)] of the tables that failed).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(stem)), exist_ok = True)
+    shards = []
+    tables = {}
+    failed = []
+    f = None
+    for name in tqdm.tqdm(names):
+        image_path = os.path.join(root_img, name + ".jpg")
+        try:
+            h, w = read_image_size(image_path)
+            classes, xywh = read_labels(os.path.join(root_label, name + ".txt"))
+            coords, texts = load_words(os.path.join(root_ocr, name + "_words.json"))
+            image = b""
+            if images:
+                with open(image_path, "rb") as img:
+                    image = img.read()
+            record = encode_record(h, w, classes, xywh, coords, texts, image)
+        except Exception as err:
+            failed.append((name, f"{type(err).__name__}: {err}"))
+            continue
+        if f is None or f.tell() >= max_bytes:
+            if f is not None:
+                f.close()
+            shards.append(f"{os.path.basename(stem)}-{len(shards):05d}.shard")
+            f = open(os.path.join(os.path.dirname(os.path.abspath(stem)), shards[-1]), "wb")
+        tables[name] = [len(shards) - 1, f.tell(), len(record)]
+        f.write(record)
+    if f is not None:
+        f.close()
+    index_path = stem + ".index.json"
+    with open(index_path, "w") as f:
+        json.dump({"shards" : shards, "tables" : tables}, f)
+    return index_path, failed
+
+
+if __name__ == '__main__':
+    # python shards.py packed/val --images
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stem")
+    parser.add_argument("--root-img", default = "images_table")
+    parser.add_argument("--root-label", default = "labels_table")
+    parser.add_argument("--root-ocr", default = "ocr_labels")
+    parser.add_argument("--images", action = "store_true", help = "also store the jpg bytes")
+    parser.add_argument("--max-bytes", type = int, default = 1 << 30)
+    args = parser.parse_args()
+
+    names = sorted(i.split(".")[0] for i in os.listdir(args.root_img))
+    index_path, failed = pack(names, args.stem, args.root_img, args.root_label, args.root_ocr, args.images, args.max_bytes)
+    for name, err in failed:
+        print(f"{name}\t{err}")
+    print(f"{len(names) - len(failed)} tables packed into {index_path}, {len(failed)} failed")
@@ -0,0 +1,156 @@
+import numpy as np
+from typing import *
+from utils import overlap_matrix, overlap_pairs, boxes_to_array, Words
+
+
+def thin_limit(threshold):
+    # a box whose clamped width or height is at most this can reach threshold without a
+    # positive overlap on that axis (see WordIndex), everything else needs one on both axes
+    return 1 / threshold * (1 + 1e-9)
+
+
+class WordIndex(object):
+    """Uniform grid over the word boxes of one table.
+
+    `query(box, threshold)` returns the positions of the words whose
+    `overlap_matrix` ratio with `box` is >= threshold, in ascending order,
+    without testing every word of the page.
+    """
+
+    def __init__(self, boxes, keys : List = None, cell_size : float = None, mode : str = "min"):
+        self.boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+        self.keys = list(range(len(self.boxes))) if keys is None else list(keys)
+        self.mode = mode
+        widths = np.maximum(1, self.boxes[:, 2] - self.boxes[:, 0])
+        heights = np.maximum(1, self.boxes[:, 3] - self.boxes[:, 1])
+        if cell_size is None:
+            cell_size = float(np.median(np.maximum(widths, heights))) if len(self.boxes) > 0 else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        # words whose clamped width or height is tiny can reach the threshold
+        # through the max(1, ...) clamp without touching the query box, so
+        # they are kept aside sorted by their smallest side
+        thin = np.minimum(widths, heights)
+        self.thin_order = np.argsort(thin, kind = "stable")
+        self.thin_sides = thin[self.thin_order]
+
+        buckets = {}
+        grid = np.floor(self.boxes / self.cell_size).astype(np.int64)
+        for idx, (gx0, gy0, gx1, gy1) in enumerate(grid.tolist()):
+            for gx in range(gx0, gx1 + 1):
+                for gy in range(gy0, gy1 + 1):
+                    buckets.setdefault((gx, gy), []).append(idx)
+        self.buckets = {key : np.array(value, dtype = np.int64) for key, value in buckets.items()}
+
+    @classmethod
+    def from_words(cls, words : Dict, mode : str = "min"):
+        if isinstance(words, Words):
+            return cls(words.boxes.coords, keys = words.keys(), mode = mode)
+        return cls(boxes_to_array([value['box'] for value in words.values()]), keys = words.keys(), mode = mode)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def candidates(self, box, threshold):
+        box = np.asarray(box, dtype = np.float64).reshape(4)
+        if threshold <= 0:
+            return np.arange(len(self.boxes))
+        limit = thin_limit(threshold)
+        if self.mode == "min" and min(max(1, box[2] - box[0]), max(1, box[3] - box[1])) <= limit:
+            return np.arange(len(self.boxes))
+        gx0, gy0, gx1, gy1 = np.floor(box / self.cell_size).astype(np.int64).tolist()
+        found = [self.thin_order[:np.searchsorted(self.thin_sides, limit, side = "right")]]
+        if (gx1 - gx0 + 1) * (gy1 - gy0 + 1) > len(self.buckets):
+            found.extend(self.buckets.values())
+        else:
+            for gx in range(gx0, gx1 + 1):
+                for gy in range(gy0, gy1 + 1):
+                    if (gx, gy) in self.buckets:
+                        found.append(self.buckets[(gx, gy)])
+        return np.unique(np.concatenate(found))
+
+    def query(self, box, threshold):
+        if hasattr(box, "xmin"):
+            box = [box.xmin, box.ymin, box.xmax, box.ymax]
+        box = np.asarray(box, dtype = np.float64).reshape(1, 4)
+        candidates = self.candidates(box, threshold)
+        ratios = overlap_matrix(self.boxes[candidates], box, mode = self.mode)[:, 0]
+        return candidates[ratios >= threshold]
+
+    def pick(self, words : Dict, positions):
+        return {self.keys[i] : words[self.keys[i]] for i in positions}
+
+    def select(self, words : Dict, box, threshold):
+        return self.pick(words, self.query(box, threshold))
+
+
+def band_ranges(lo, hi, query_lo, query_hi):
+    # bands sorted by lo; for each query [start, stop) covers every band with lo < query_hi and hi > query_lo
+    order = np.argsort(lo, kind = "stable")
+    reach = np.maximum.accumulate(hi[order])
+    start = np.searchsorted(reach, query_lo, side = "right")
+    stop = np.searchsorted(lo[order], query_hi, side = "left")
+    return order, start, np.maximum(stop, start)
+
+def assign_to_grid(boxes, cells, cell_rows, cell_cols, threshold, mode = "min"):
+    """Per cell, the ascending positions of the `boxes` whose overlap_matrix
+    ratio with it is >= threshold; the same as WordIndex.query on every cell.
+
+    Cells are products of row and column bands: cell i lies in row band
+    cell_rows[i] and column band cell_cols[i], and (row, column) pairs are
+    unique. Each box finds the bands it overlaps by binary search over the
+    sorted band edges, so a box straddling a band edge is tried against the
+    cells on both sides and the exact ratio decides. Boxes (and in "min"
+    mode cells) thin enough to pass through the max(1, ...) clamp are tried
+    against everything.
+    """
+    boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+    cells = np.asarray(cells, dtype = np.float64).reshape(-1, 4)
+    cell_rows = np.asarray(cell_rows, dtype = np.int64)
+    cell_cols = np.asarray(cell_cols, dtype = np.int64)
+    n, k = len(boxes), len(cells)
+    if n == 0 or k == 0:
+        return [np.empty(0, dtype = np.int64) for _ in range(k)]
+    if threshold <= 0:
+        return [np.arange(n) for _ in range(k)]
+
+    num_rows, num_cols = int(cell_rows.max()) + 1, int(cell_cols.max()) + 1
+    cell_id = np.full((num_rows, num_cols), -1, dtype = np.int64)
+    cell_id[cell_rows, cell_cols] = np.arange(k)
+    # band extents, widened to every cell in the band
+    row_lo = np.full(num_rows, np.inf)
+    row_hi = np.full(num_rows, -np.inf)
+    col_lo = np.full(num_cols, np.inf)
+    col_hi = np.full(num_cols, -np.inf)
+    np.minimum.at(row_lo, cell_rows, cells[:, 1])
+    np.maximum.at(row_hi, cell_rows, cells[:, 3])
+    np.minimum.at(col_lo, cell_cols, cells[:, 0])
+    np.maximum.at(col_hi, cell_cols, cells[:, 2])
+
+    row_order, row_start, row_stop = band_ranges(row_lo, row_hi, boxes[:, 1], boxes[:, 3])
+    col_order, col_start, col_stop = band_ranges(col_lo, col_hi, boxes[:, 0], boxes[:, 2])
+    num_r = row_stop - row_start
+    num_c = col_stop - col_start
+    count = num_r * num_c
+    word = np.repeat(np.arange(n), count)
+    step = np.arange(len(word)) - np.repeat(np.cumsum(count) - count, count)
+    row = row_order[row_start[word] + step // num_c[word]]
+    col = col_order[col_start[word] + step % num_c[word]]
+    cell = cell_id[row, col]
+    word, cell = [word[cell >= 0]], [cell[cell >= 0]]
+
+    limit = thin_limit(threshold)
+    thin = np.flatnonzero(np.minimum(np.maximum(1, boxes[:, 2] - boxes[:, 0]), np.maximum(1, boxes[:, 3] - boxes[:, 1])) <= limit)
+    word.append(np.repeat(thin, k))
+    cell.append(np.tile(np.arange(k), len(thin)))
+    if mode == "min":
+        thin = np.flatnonzero(np.minimum(np.maximum(1, cells[:, 2] - cells[:, 0]), np.maximum(1, cells[:, 3] - cells[:, 1])) <= limit)
+        word.append(np.tile(np.arange(n), len(thin)))
+        cell.append(np.repeat(thin, n))
+
+    pairs = np.unique(np.concatenate(cell) * n + np.concatenate(word))
+    cell, word = pairs // n, pairs % n
+    keep = overlap_pairs(boxes[word], cells[cell], mode = mode) >= threshold
+    cell, word = cell[keep], word[keep]
+    # pairs are sorted by cell, then word
+    return np.split(word, np.cumsum(np.bincount(cell, minlength = k))[:-1])
@@ -0,0 +1,110 @@
+import os
+import json
+import random
+import argparse
+import numpy as np
+import cv2
+from typing import *
+
+from utils import dict_label
+
+LABEL_ID = {value : key for key, value in dict_label.items()}
+
+
+def make_table(rng : random.Random, rows : int = 10, cols : int = 5, header_rows : int = 1, spanning : int = 1,
+               projected : int = 1, words_per_cell : int = 3, lines_per_cell : int = 1, cell_width : int = 90, row_height : int = 24,
+               margin : int = 10):
+    """One synthetic PubTables-style table.
+
+    Returns (h, w, elements, words): elements as (label name, [xmin, ymin,
+    xmax, ymax]) and words as {"bbox", "text"} like the `_words.json` files.
+    A two-row header gets spanning cells over pairs of columns in its first
+    row; `spanning` more are placed in the body, `projected` body rows become
+    full-width projected row headers.
+    """
+    header_rows = min(header_rows, rows - 1)
+    h = rows * row_height + 2 * margin
+    w = cols * cell_width + 2 * margin
+    # grid lines sit on half pixels so int() of the denormalized labels is stable
+    xs = [margin + i * cell_width + 0.5 for i in range(cols + 1)]
+    ys = [margin + j * row_height + 0.5 for j in range(rows + 1)]
+    elements = [("table", [xs[0], ys[0], xs[-1], ys[-1]])]
+    elements += [("table_column", [xs[i], ys[0], xs[i + 1], ys[-1]]) for i in range(cols)]
+    elements += [("table_row", [xs[0], ys[j], xs[-1], ys[j + 1]]) for j in range(rows)]
+
+    merged = set()
+    if header_rows > 0:
+        elements.append(("table_column_header", [xs[0], ys[0], xs[-1], ys[header_rows]]))
+    if header_rows == 2:
+        for i in range(1, cols - 1, 2):
+            elements.append(("table_spanning_cell", [xs[i], ys[0], xs[i + 2], ys[1]]))
+            merged.update([(0, i), (0, i + 1)])
+    body = list(range(header_rows, rows))
+    projected_rows = sorted(rng.sample(body, min(projected, len(body))))
+    for j in projected_rows:
+        elements.append(("table_projected_row_header", [xs[0], ys[j], xs[-1], ys[j + 1]]))
+        merged.update((j, i) for i in range(cols))
+    free = [(j, i) for j in body if j not in projected_rows and j + 1 < rows and j + 1 not in projected_rows for i in range(1, cols)]
+    for j, i in rng.sample(free, min(spanning, len(free))):
+        if (j, i) in merged or (j + 1, i) in merged:
+            continue
+        elements.append(("table_spanning_cell", [xs[i], ys[j], xs[i + 1], ys[j + 2]]))
+        merged.update([(j, i), (j + 1, i)])
+
+    regions = [[xs[i], ys[j], xs[i + 1], ys[j + 1]] for j in range(rows) for i in range(cols) if (j, i) not in merged]
+    regions += [box for label, box in elements if label in ["table_spanning_cell", "table_projected_row_header"]]
+    words = []
+    for xmin, ymin, xmax, ymax in regions:
+        line_height = (ymax - ymin) / (lines_per_cell + 1)
+        for line in range(lines_per_cell):
+            y = ymin + line_height * (line + 0.5)
+            x = xmin + 3
+            for _ in range(words_per_cell):
+                width = rng.uniform(6, 20)
+                if x + width > xmax - 3:
+                    break
+                words.append({
+                    "bbox" : [round(x, 2), round(y, 2), round(x + width, 2), round(y + min(line_height * 0.8, 10), 2)],
+                    "text" : "w%d" % len(words)
+                })
+                x += width + rng.uniform(2, 5)
+    rng.shuffle(words)
+    return h, w, elements, words
+
+def write_table(root : str, name : str, h : int, w : int, elements : List, words : List):
+    with open(os.path.join(root, "labels_table", name + ".txt"), 'w') as f:
+        for label, (xmin, ymin, xmax, ymax) in elements:
+            f.write("%d %.6f %.6f %.6f %.6f\n" % (LABEL_ID[label], (xmin + xmax) / 2 / w, (ymin + ymax) / 2 / h, (xmax - xmin) / w, (ymax - ymin) / h))
+    with open(os.path.join(root, "ocr_labels", name + "_words.json"), 'w') as f:
+        json.dump(words, f)
+    cv2.imwrite(os.path.join(root, "images_table", name + ".jpg"), np.full((h, w, 3), 255, dtype = np.uint8))
+
+def generate(root : str, num : int, seed : int = 0, **kwargs):
+    # writes `num` tables under root/{images_table, labels_table, ocr_labels} and returns their names
+    for folder in ["images_table", "labels_table", "ocr_labels", "visualize"]:
+        os.makedirs(os.path.join(root, folder), exist_ok = True)
+    rng = random.Random(seed)
+    names = []
+    for idx in range(num):
+        name = f"SYN{seed:04d}_table_{idx}"
+        write_table(root, name, *make_table(rng, **kwargs))
+        names.append(name)
+    return names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("--num", type = int, default = 10)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--rows", type = int, default = 10)
+    parser.add_argument("--cols", type = int, default = 5)
+    parser.add_argument("--header-rows", type = int, default = 1)
+    parser.add_argument("--spanning", type = int, default = 1)
+    parser.add_argument("--projected", type = int, default = 1)
+    parser.add_argument("--words-per-cell", type = int, default = 3)
+    parser.add_argument("--lines-per-cell", type = int, default = 1)
+    args = parser.parse_args()
+    generate(args.root, args.num, args.seed, rows = args.rows, cols = args.cols, header_rows = args.header_rows,
+             spanning = args.spanning, projected = args.projected, words_per_cell = args.words_per_cell,
+             lines_per_cell = args.lines_per_cell)
@@ -1,5 +1,11 @@
 from typing import *
-from utils import is_overlap, with_line, Box, read_ocr, read_file, draw_rectangle, get_color, draw_arrow
+from utils import is_overlap, with_line, Box, read_ocr, read_file, draw_rectangle, get_color, draw_arrow, boxes_to_array
+from spatial import WordIndex, assign_to_grid
+from links import LinkStore
+from cluster import center_rank
+from writer import AnnotationWriter, assemble
+from render import visualize
+from export import AnnotationColumns
 import os
 import numpy as np
 import json
@@ -15,7 +21,11 @@ class Table(object):
     def __init__(self, boxes_text, boxes_element):
 
         self.boxes_text = boxes_text
-        self.boxes_element = boxes_element
+        self.boxes_element = list(zip(*boxes_element))
+        self.word_index = WordIndex.from_words(boxes_text)
+        # words ranked once by ycenter, get_multiline only reorders by rank
+        ycenters = (self.word_index.boxes[:, 1] + self.word_index.boxes[:, 3]) / 2
+        self.y_rank = dict(zip(self.word_index.keys, center_rank(ycenters).tolist()))
 
         self.label = {
             0 : "table",
@@ -26,19 +36,15 @@ class Table(object):
             5 : "table_spanning_cell"
         }
         self.metadata = self.__get_metadata()
-        self.matrix = np.zeros(shape = (len(boxes_text), len(boxes_text)))
+        self.links = LinkStore(len(boxes_text))
     
     def get_box_text_in(self, box):
-        result = {}
-        for key, value in self.boxes_text.items():
-            if is_overlap(value['bbox'], box, threshold = 0.95):
-                result[key] = value
-        return result
+        return self.word_index.select(self.boxes_text, box, threshold = 0.95)
 
     def get_multiline(self, dict_box : Dict):
         result = {}
         idx = 0
-        dict_box = {k : v for k, v in sorted(dict_box.items(), key = lambda  x : x[1]['bbox'].ycenter)}
+        dict_box = {k : v for k, v in sorted(dict_box.items(), key = lambda  x : self.y_rank[x[0]])}
         for v in dict_box.values():
             result[f'line-{idx}'] = v
             idx += 1
@@ -47,24 +53,26 @@ class Table(object):
     def get_box_cell(self, metadata):
         metadata['cell'] = []
         idx = 0
-        for col in metadata['table_column']:
-            box_col = col['box_item']
-            for row in metadata['table_row']:
-                box_row = row['box_item']
-                box_cell = Box([box_col.xmin, box_row.ymin, box_col.xmax, box_row.ymax])
-                text_in_cell = self.get_box_text_in(box_cell)
-                lines = self.get_multiline(text_in_cell)
-                list_id = [i['id'] for i in text_in_cell.values()]
-                metadata['cell'].append(
-                    {
-                        "box_item" : box_cell,
-                        "list_id" : list_id,
-                        "list_box_text" : text_in_cell,
-                        "lines" : lines,
-                        "id" : idx,
-                    }
-                )
-                idx += 1
+        num_rows = len(metadata['table_row'])
+        box_cells = [Box([col['box_item'].xmin, row['box_item'].ymin, col['box_item'].xmax, row['box_item'].ymax])
+                     for col in metadata['table_column'] for row in metadata['table_row']]
+        # cells run column major: cell i is in column band i // num_rows, row band i % num_rows
+        positions = np.arange(len(box_cells))
+        words = assign_to_grid(self.word_index.boxes, boxes_to_array(box_cells), positions % max(num_rows, 1), positions // max(num_rows, 1), 0.95, self.word_index.mode)
+        for box_cell, word in zip(box_cells, words):
+            text_in_cell = self.word_index.pick(self.boxes_text, word)
+            lines = self.get_multiline(text_in_cell)
+            list_id = [i['id'] for i in text_in_cell.values()]
+            metadata['cell'].append(
+                {
+                    "box_item" : box_cell,
+                    "list_id" : list_id,
+                    "list_box_text" : text_in_cell,
+                    "lines" : lines,
+                    "id" : idx,
+                }
+            )
+            idx += 1
         return metadata
 
     def __get_metadata(self):
@@ -135,7 +143,7 @@ class Table(object):
                         if cell['box_item'].xmin >= box_span.xmin - 2 and cell['box_item'].xmax <= box_span.xmax + 2:
                             if len(cell['lines']) > 0:
                                 list_id.append(cell['lines']['line-0']['id'])
-                                self.matrix[cell['lines']['line-0']['id']][id_head] = 1
+                                self.links.add(cell['lines']['line-0']['id'], id_head)
             return list_id
 
     def get_link_in_cell(self):
@@ -145,7 +153,7 @@ class Table(object):
                 for key in cell['lines']:
                     if key != 'line-0':
                         tail_idx = cell['lines'][key]['id']
-                        self.matrix[head_idx][tail_idx] = 1
+                        self.links.add(head_idx, tail_idx)
 
 
     def get_link_in_row(self):
@@ -158,8 +166,8 @@ class Table(object):
             for i1 in list_id:
                 for i2 in list_id:
                     if i1 != i2:
-                        self.matrix[i1][i2] = 1
-                        self.matrix[i2][i1] = 1
+                        self.links.add(i1, i2)
+                        self.links.add(i2, i1)
 
     def get_link_cell_with_header(self):
         list_id_header = self.get_header()
@@ -172,7 +180,7 @@ class Table(object):
                         lst_span = span['list_id']
                         lst_col = list(set(lst_col) - set(lst_span))
                         for c in lst_col:
-                            self.matrix[c][header_choice] = 1
+                            self.links.add(c, header_choice[0])
 
             list_cell_col = sorted(col['list_cell'], key=lambda x:x['box_item'].ycenter)
             if len(list_cell_col[0]['lines']) == 0:
@@ -183,10 +191,10 @@ class Table(object):
                     c_id = list(set(c_col['list_id']) - set(list_id_header))
                     if len(c_id) > 1:
                         tail_idx = c_col['lines']['line-0']['id']
-                        self.matrix[tail_idx][head_idx] = 1
+                        self.links.add(tail_idx, head_idx)
                     elif len(c_id) == 1:
                         tail_idx = c_id[0]
-                        self.matrix[tail_idx][head_idx] = 1
+                        self.links.add(tail_idx, head_idx)
 
 
 
@@ -195,40 +203,21 @@ class Table(object):
         self.get_link_in_row()
         self.get_link_cell_with_header()
 
-def gen_annotations(boxes_ocr, matrix):
-    documents = []
-    h, w = np.shape(matrix)[:2]
-    for ocr in boxes_ocr.values():
-        # print(ocr['bbox'])
-        temp = {
-            "box" : [ocr['bbox'].xmin, ocr['bbox'].ymin, ocr['bbox'].xmax, ocr['bbox'].ymax],
-            "text" : ocr['text'],
-            "word" : [],
-            "id" : ocr['id'],
-            "linking" : []
-        }
-        for i in range(w):
-            if matrix[ocr['id']][i] == 1:
-                temp['linking'].append([ocr['id'], i])
-        documents.append(temp)
-    return documents
-
-
-def visualize(image, annotation):
-    for doc in annotation:
-        color = get_color()
-        box_1 = doc['box']
-        linking = doc['linking']
-        if len(linking) > 0:
-            for link in linking:
-                i = link[1]
-                for doc_2 in annotation:
-                    if int(doc_2['id']) == int(i):
-                        box_2 = doc_2['box']
-                        image = draw_rectangle(image, box_1, color)
-                        image = draw_rectangle(image, box_2, color)
-                        draw_arrow(image, box_1, box_2, color)
-    return image
+def annotation_columns(boxes_ocr, links):
+    # one line per OCR word, links (self links included) from the LinkStore
+    ids = np.array([ocr['id'] for ocr in boxes_ocr.values()], dtype = np.int64)
+    edge_line, tails = links.rows(ids)
+    return AnnotationColumns(
+        boxes = boxes_to_array([ocr['box'] for ocr in boxes_ocr.values()]),
+        texts = [ocr['text'] for ocr in boxes_ocr.values()],
+        ids = ids,
+        edge_line = edge_line,
+        edges = np.stack([ids[edge_line], tails], axis = 1)
+    )
+
+def gen_annotations(boxes_ocr, links):
+    return annotation_columns(boxes_ocr, links).to_documents()
+
 
 def run(name, idx):
     image_path = os.path.join(ROOT_IMG, name + ".jpg")
@@ -243,7 +232,7 @@ def run(name, idx):
 
     table = Table(boxes_text, boxes_element)
     table.create_link()
-    anno = gen_annotations(boxes_text, table.matrix)
+    anno = gen_annotations(boxes_text, table.links)
     # print(anno)
 
     image = visualize(image, anno)
@@ -261,25 +250,16 @@ if __name__ == "__main__":
     import cv2
     names = [i.split(".")[0] for i in os.listdir(ROOT_IMG)]
 
-    annotations = {
-        "lang" : "vi",
-        "info" : {
-            "author" : "ThanThoai",
-            "version" : 1.0
-        },
-        "documents" : []
-    }
-
-    with open("log_30_3.txt", 'w') as wr:
+    stream = AnnotationWriter("pubtable1m_entity_linking_v1.jsonl")
+    with open("log_30_3.txt", 'w') as wr, stream:
         for idx, name in tqdm.tqdm(enumerate(names)):
             try:
                 anno = run(name, idx)
-                annotations['documents'].append(anno)
+                stream.write(anno)
             except Exception as err:
                 wr.write(f"{name}\t{err}")
         # 1/0
-    with open("pubtable1m_entity_linking_v1.json", 'w') as f:
-        json.dump(annotations, f, ensure_ascii=False)
+    assemble(stream.paths, "pubtable1m_entity_linking_v1.json")
     
     # image = cv2.imread(image_path)
 
@@ -294,7 +274,7 @@ if __name__ == "__main__":
 
     # color = get_color()
     # for idx in id_header:
-    #     image = draw_rectangle(image, boxes_text[idx]['bbox'].get_box(), color)
+    #     image = draw_rectangle(image, boxes_text[idx]['box'].get_box(), color)
         
     # cv2.imwrite("header.jpg", image)
 
@@ -0,0 +1,49 @@
+import random
+import collections
+import numpy as np
+import pytest
+
+from utils import BoxArray, Words, yolo_to_boxes
+from synthetic import make_table, LABEL_ID
+from main import Table, annotation_columns
+
+
+def jittered_table(rng : random.Random):
+    # a synthetic table whose words are shifted by up to about half a cell, so
+    # some cross cell edges, and a few words are placed around the table
+    h, w, elements, words = make_table(rng, rows = rng.randint(3, 12), cols = rng.randint(2, 6), header_rows = rng.randint(0, 2),
+                                       spanning = rng.randint(0, 3), projected = rng.randint(0, 2), words_per_cell = rng.randint(1, 4),
+                                       lines_per_cell = rng.randint(1, 2))
+    coords = []
+    for word in words:
+        dx, dy = rng.choice([0, 0, rng.uniform(-45, 45)]), rng.choice([0, 0, rng.uniform(-12, 12)])
+        xmin, ymin, xmax, ymax = word["bbox"]
+        # jittered words stay inside the image, like real OCR boxes
+        dx, dy = min(max(dx, -xmin), w - xmax), min(max(dy, -ymin), h - ymax)
+        coords.append([xmin + dx, ymin + dy, xmax + dx, ymax + dy])
+    for _ in range(rng.randint(0, 4)):
+        x, y = rng.uniform(0, w - 10), rng.choice([rng.uniform(0, 3), rng.uniform(h - 9, h - 7)])
+        coords.append([x, y, x + 10, y + 6])
+    classes = [LABEL_ID[label] for label, _ in elements]
+    xywh = [[(xmin + xmax) / 2 / w, (ymin + ymax) / 2 / h, (xmax - xmin) / w, (ymax - ymin) / h] for _, (xmin, ymin, xmax, ymax) in elements]
+    texts = ["w%d" % i for i in range(len(coords))]
+    return Words(BoxArray.from_list(coords, h = h, w = w), texts), yolo_to_boxes(classes, xywh, h, w)
+
+
+def test_every_word_is_emitted_once():
+    rng = random.Random(0)
+    for _ in range(60):
+        words, elements = jittered_table(rng)
+        try:
+            table = Table(words, elements)
+        except TypeError:
+            # header shapes the rules do not support
+            continue
+        table.create_link()
+        columns = annotation_columns(table, words)
+        emitted = collections.Counter(columns.word_texts)
+        assert sorted(emitted) == sorted(words.texts)
+        assert max(emitted.values()) == 1
+        # an "other" line is exactly its one word
+        other = np.flatnonzero(columns.labels == 2)
+        assert np.bincount(columns.word_line, minlength = len(columns))[other].tolist() == [1] * len(other)
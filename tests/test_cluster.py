@@ -0,0 +1,61 @@
+import random
+import pytest
+
+from utils import Box
+from cluster import cluster_by_center, chain_lines
+from main import is_on_same_line
+
+
+# the pairwise loops cluster_by_center and chain_lines replaced
+def loop_clusters(centers, order, tolerance):
+    assigned = [False] * len(centers)
+    groups = []
+    for seed in order:
+        if assigned[seed]:
+            continue
+        members = [j for j in order if not assigned[j] and abs(centers[seed] - centers[j]) <= tolerance]
+        for j in members:
+            assigned[j] = True
+        groups.append(members)
+    return groups
+
+def loop_lines(items, same_line):
+    lines = []
+    rightmost = []
+    for j, item in enumerate(items):
+        for k in range(len(lines)):
+            if same_line(rightmost[k], item):
+                lines[k].append(j)
+                rightmost[k] = item
+                break
+        else:
+            lines.append([j])
+            rightmost.append(item)
+    return lines
+
+
+@pytest.mark.parametrize("tolerance", [0, 5, 12.5])
+def test_cluster_by_center_matches_loop(tolerance):
+    rng = random.Random(0)
+    for _ in range(1000):
+        n = rng.randint(0, 40)
+        # centers on a coarse grid too, so ties and exact tolerance distances occur
+        centers = [rng.choice([rng.uniform(0, 100), rng.randint(0, 20) * 2.5]) for _ in range(n)]
+        order = list(range(n))
+        rng.shuffle(order)
+        assert cluster_by_center(centers, order, tolerance) == loop_clusters(centers, order, tolerance)
+
+
+@pytest.mark.parametrize("ratio", [0.8, 0.5, None])
+def test_chain_lines_matches_loop(ratio):
+    rng = random.Random(0)
+    same_line = lambda a, b : is_on_same_line(a, b, ratio)
+    for _ in range(1000):
+        boxes = []
+        for _ in range(rng.randint(0, 40)):
+            y = rng.choice([rng.uniform(0, 100), rng.randint(0, 10) * 10])
+            x = rng.uniform(0, 200)
+            boxes.append(Box([x, y, x + rng.uniform(0, 20), y + rng.choice([rng.uniform(0, 30), 10, 0])]))
+        boxes.sort(key = lambda b : b.xmin)
+        spans = [[b.ymin, b.ymax] for b in boxes]
+        assert chain_lines(boxes, same_line, spans) == loop_lines(boxes, same_line)
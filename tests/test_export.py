@@ -0,0 +1,40 @@
+import json
+import numpy as np
+import pytest
+
+from export import AnnotationColumns
+
+TEXTS = ["", "a", "Total (%)", 'say "hi"', "back\\slash", "tab\tnew\nline", "\x00\x1f", "Tổng cộng", "µ ± σ", "😀", " "]
+
+
+def random_columns(rng, labels = True, finite = True):
+    num_lines = int(rng.integers(0, 30))
+    num_words = int(rng.integers(0, 60))
+    num_edges = int(rng.integers(0, 40))
+    values = rng.choice([0.0, 1.0, -2.5, 1e-7, 123.456, 1e17, 0.1 + 0.2], (num_lines + num_words, 4)) * rng.uniform(0.5, 1.5, (num_lines + num_words, 4))
+    if not finite and len(values) > 0:
+        values.flat[rng.integers(0, values.size)] = rng.choice([np.nan, np.inf, -np.inf])
+    texts = [TEXTS[i] for i in rng.integers(0, len(TEXTS), num_lines + num_words)]
+    return AnnotationColumns(
+        boxes = values[:num_lines],
+        texts = texts[:num_lines],
+        ids = np.arange(num_lines),
+        labels = rng.integers(0, 3, num_lines) if labels else None,
+        word_line = np.sort(rng.integers(0, max(num_lines, 1), num_words if num_lines else 0)),
+        word_boxes = values[num_lines:num_lines + (num_words if num_lines else 0)],
+        word_texts = texts[num_lines:num_lines + (num_words if num_lines else 0)],
+        edge_line = np.sort(rng.integers(0, max(num_lines, 1), num_edges if num_lines else 0)),
+        edges = rng.integers(0, max(num_lines, 1), (num_edges if num_lines else 0, 2))
+    )
+
+
+@pytest.mark.parametrize("labels", [True, False])
+@pytest.mark.parametrize("finite", [True, False])
+def test_encode_matches_json_dumps(labels, finite):
+    rng = np.random.default_rng(0)
+    for i in range(200):
+        columns = random_columns(rng, labels, finite)
+        name = TEXTS[i % len(TEXTS)] + "_table_%d" % i
+        expected = json.dumps({"id" : name, "document" : columns.to_documents(), "image" : name}, ensure_ascii=False)
+        assert columns.encode(name, image = name) == expected
+
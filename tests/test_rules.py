@@ -0,0 +1,133 @@
+import random
+import pytest
+
+from main import Table, RelativeBox, IdAllocator
+from links import LinkStore
+from rules import CellGrid
+
+
+class TextStub(object):
+    # the parts of TextBox the rules read: first line id, other line ids, lines
+    def __init__(self, num_lines, ids):
+        self.lines = {f"line-{i}" : {"id" : ids.next()} for i in range(num_lines)}
+        self.id = self.lines["line-0"]["id"] if num_lines > 0 else None
+        self.relative_id = [line["id"] for key, line in self.lines.items() if key != "line-0"]
+
+
+class CellStub(object):
+    def __init__(self, span, type, num_lines, ids):
+        self.RBox = RelativeBox(span)
+        self.TBox = TextStub(num_lines, ids)
+        self.type = type
+
+
+# the loop rules the vectorized ones replaced (main.Table before rules.py)
+def loop_links(metadata, header):
+    links = LinkStore()
+    by_row, by_col, by_type = {}, {}, {}
+    for cell in metadata:
+        by_row.setdefault((cell.RBox.row_start, cell.RBox.row_end), []).append(cell)
+        by_col.setdefault((cell.RBox.col_start, cell.RBox.col_end), []).append(cell)
+        by_type.setdefault(cell.type, []).append(cell)
+
+    row_end_header = header[0].row_end if len(header) == 1 else 0
+    for cell_1 in by_type.get('cell', []):
+        if cell_1.RBox.row_end > row_end_header:
+            for cell_2 in by_row[(cell_1.RBox.row_start, cell_1.RBox.row_end)]:
+                if cell_2.type == 'cell' and cell_1.TBox.id is not None and cell_2.TBox.id is not None and cell_1.TBox.id != cell_2.TBox.id:
+                    links.add(cell_1.TBox.id, cell_2.TBox.id)
+                    links.add(cell_2.TBox.id, cell_1.TBox.id)
+
+    for cell in metadata:
+        if len(cell.TBox.lines) >= 2:
+            for i in cell.TBox.relative_id:
+                links.add(cell.TBox.id, i)
+
+    headers = []
+    if len(header) == 1:
+        if header[0].num_row == 1:
+            headers = [c for c in by_row.get((header[0].row_start, header[0].row_end), []) if c.type == 'cell' and c.TBox.id is not None]
+        else:
+            selected = [c for c in by_type.get('table_spanning_cell', []) if c.RBox.row_start == header[0].row_start]
+            if sum(c.RBox.num_grid for c in selected) == header[0].num_grid:
+                headers = [c for c in selected if c.TBox.id is not None]
+            else:
+                for cell in selected:
+                    if cell.RBox.num_row == header[0].num_row and cell.TBox.id is not None:
+                        headers.append(cell)
+                    else:
+                        for c in by_type.get('cell', []):
+                            if c.RBox.row_start == cell.RBox.row_end and c.RBox.col_start >= cell.RBox.col_start and c.RBox.col_end <= cell.RBox.col_end and c.TBox.id is not None:
+                                headers.append(c)
+                                links.add(c.TBox.id, cell.TBox.id)
+    for h in headers:
+        for cell in by_col.get((h.RBox.col_start, h.RBox.col_end), []):
+            if cell.type == 'cell' and cell.TBox.id is not None:
+                links.add(cell.TBox.id, h.TBox.id)
+
+    projected = sorted(by_type.get('table_projected_row_header', []), key = lambda x : x.RBox.row_start)
+    for idx, p in enumerate(projected[:-1]):
+        for cell in by_col.get((p.RBox.col_start, 1), []):
+            if cell.type == 'cell' and cell.RBox.row_start >= p.RBox.row_end and cell.RBox.row_end > projected[idx + 1].RBox.row_start:
+                if cell.TBox.id is not None:
+                    links.add(cell.TBox.id, p.TBox.id)
+    for p in projected[-1:]:
+        for cell in by_col.get((p.RBox.col_start, 1), []):
+            if cell.type == 'cell' and cell.RBox.row_start >= p.RBox.row_end and cell.TBox.id is not None:
+                links.add(cell.TBox.id, p.TBox.id)
+    return links
+
+
+def random_grid(rng : random.Random):
+    rows, cols = rng.randint(1, 10), rng.randint(1, 6)
+    ids = IdAllocator()
+    metadata = []
+    header = []
+    header_rows = rng.choice([0, 1, 2])
+    if header_rows > 0 and rows > header_rows:
+        header.append(RelativeBox((0, header_rows, 0, cols)))
+    spanning = []
+    if header_rows == 2:
+        # spanning cells on the first header row, some two rows tall, covering all or part of it
+        col = 0
+        while col < cols:
+            width = rng.randint(1, 3)
+            if rng.random() < 0.8:
+                spanning.append((0, rng.choice([1, 2]), col, min(col + width, cols)))
+            col += width
+    for _ in range(rng.randint(0, 3)):
+        r, c = rng.randrange(rows), rng.randrange(cols)
+        spanning.append((r, min(r + rng.randint(1, 2), rows), c, min(c + rng.randint(1, 2), cols)))
+    projected = [(r, r + 1, rng.choice([0, 0, 1]), cols) for r in rng.sample(range(rows), rng.randint(0, min(3, rows)))]
+    for r in range(rows):
+        for c in range(cols):
+            if rng.random() < 0.9:
+                metadata.append(CellStub((r, r + 1, c, c + 1), 'cell', rng.choice([0, 1, 1, 2, 3]), ids))
+    for span in projected:
+        metadata.append(CellStub(span, 'table_projected_row_header', rng.choice([0, 1, 2]), ids))
+    for span in spanning:
+        metadata.append(CellStub(span, 'table_spanning_cell', rng.choice([0, 1, 2]), ids))
+    return metadata, header, ids
+
+
+def test_rules_match_loops():
+    rng = random.Random(0)
+    for _ in range(3000):
+        metadata, header, ids = random_grid(rng)
+        table = Table.__new__(Table)
+        table.metadata, table.header = metadata, header
+        table.grid = CellGrid.from_cells(metadata)
+        table.links = LinkStore(ids.count + 1)
+        table.create_link()
+        assert table.links.edges == loop_links(metadata, header).edges
+
+
+def test_unsupported_header():
+    ids = IdAllocator()
+    table = Table.__new__(Table)
+    table.metadata = [CellStub((r, r + 1, 0, 1), 'cell', 1, ids) for r in range(4)]
+    table.header = [RelativeBox((0, 3, 0, 1))]
+    table.grid = CellGrid.from_cells(table.metadata)
+    table.links = LinkStore(ids.count + 1)
+    with pytest.raises(TypeError):
+        table.create_link()
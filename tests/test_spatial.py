@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from utils import overlap_matrix
+from spatial import WordIndex, assign_to_grid
+
+
+def random_bands(rng, count, size):
+    # sorted band starts with random extents: some tiny, zero-size or overlapping the next band
+    lo = np.sort(rng.uniform(0, size, count))
+    extent = rng.choice([0.0, 0.5, 1.0, 5.0, 40.0, 120.0], count) * rng.uniform(0.5, 1.5, count)
+    return np.stack([lo, lo + extent], axis = 1)
+
+def random_table(rng):
+    rows = random_bands(rng, int(rng.integers(1, 12)), 400)
+    cols = random_bands(rng, int(rng.integers(1, 12)), 600)
+    cell_rows, cell_cols = np.divmod(np.arange(len(rows) * len(cols)), len(cols))
+    keep = rng.random(len(cell_rows)) < 0.8
+    cell_rows, cell_cols = cell_rows[keep], cell_cols[keep]
+    cells = np.stack([cols[cell_cols, 0], rows[cell_rows, 0], cols[cell_cols, 1], rows[cell_rows, 1]], axis = 1)
+    num_words = int(rng.integers(0, 80))
+    xy = rng.uniform(-20, 620, (num_words, 2))
+    wh = rng.choice([0.0, 0.3, 1.0, 3.0, 15.0, 60.0], (num_words, 2)) * rng.uniform(0.5, 1.5, (num_words, 2))
+    words = np.concatenate([xy, xy + wh], axis = 1)
+    return words, cells, cell_rows, cell_cols
+
+
+@pytest.mark.parametrize("mode", ["min", "first"])
+@pytest.mark.parametrize("threshold", [0.8, 0.95, 0.5])
+def test_assign_to_grid_matches_query(mode, threshold):
+    rng = np.random.default_rng(0)
+    for _ in range(150):
+        words, cells, cell_rows, cell_cols = random_table(rng)
+        index = WordIndex(words, mode = mode)
+        found = assign_to_grid(words, cells, cell_rows, cell_cols, threshold, mode)
+        assert len(found) == len(cells)
+        expected = overlap_matrix(words, cells, mode = mode) >= threshold
+        for i, cell in enumerate(cells):
+            assert found[i].tolist() == np.flatnonzero(expected[:, i]).tolist()
+            assert found[i].tolist() == index.query(cell, threshold).tolist()
+
+
+def test_assign_to_grid_empty():
+    cells = np.array([[0, 0, 10, 10]], dtype = np.float64)
+    assert [f.tolist() for f in assign_to_grid(np.zeros((0, 4)), cells, [0], [0], 0.8)] == [[]]
+    assert assign_to_grid(np.array([[1, 1, 2, 2]]), np.zeros((0, 4)), [], [], 0.8) == []
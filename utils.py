@@ -1,26 +1,144 @@
 import numpy as np
 from typing import *
 import cv2
+import os
 import json
+import struct
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class Box(object):
 
-    def __init__(self, bbox : List, h : float = None, w : float = None):
-        if h is None:
-            h = float("inf")
-        if w is None:
-            w = float("inf")
-        self.xmin = max(bbox[0], 0)
-        self.ymin = max(bbox[1], 0)
-        self.xmax = min(bbox[2], w)
-        self.ymax = min(bbox[3], h)
+class Box(object):
+    __slots__ = ("xmin", "ymin", "xmax", "ymax", "xcenter", "ycenter")
+
+    def __init__(self, bbox : List, h : float = None, w : float = None, clip : bool = True):
+        if clip:
+            if h is None:
+                h = float("inf")
+            if w is None:
+                w = float("inf")
+            self.xmin = max(bbox[0], 0)
+            self.ymin = max(bbox[1], 0)
+            self.xmax = min(bbox[2], w)
+            self.ymax = min(bbox[3], h)
+        else:
+            self.xmin = bbox[0]
+            self.ymin = bbox[1]
+            self.xmax = bbox[2]
+            self.ymax = bbox[3]
         self.xcenter = (self.xmin + self.xmax) / 2
         self.ycenter = (self.ymin + self.ymax) / 2
 
     def get_box(self):
         return [self.xmin, self.ymin, self.xmax, self.ymax]
 
+
+class BoxArray(object):
+    """Struct-of-arrays storage for many boxes.
+
+    `data` holds one contiguous row per field (xmin, ymin, xmax, ymax,
+    xcenter, ycenter); indexing with an int gives a `Box`, with a slice,
+    mask or index array a new `BoxArray`.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, coords, dtype = np.float64):
+        coords = np.asarray(coords, dtype = dtype).reshape(-1, 4)
+        self.data = np.empty((6, len(coords)), dtype = dtype)
+        self.data[:4] = coords.T
+        self.data[4] = (coords[:, 0] + coords[:, 2]) / 2
+        self.data[5] = (coords[:, 1] + coords[:, 3]) / 2
+
+    @classmethod
+    def from_boxes(cls, boxes, dtype = np.float64):
+        return cls(boxes_to_array(boxes), dtype = dtype)
+
+    @classmethod
+    def from_list(cls, bboxes, h : float = None, w : float = None, clip : bool = True, dtype = np.float64):
+        boxes = cls(bboxes, dtype = dtype)
+        return boxes.clip(h, w) if clip else boxes
+
+    def clip(self, h : float = None, w : float = None):
+        # same bounds as Box(bbox, h, w): 0 below, the image size above
+        coords = self.coords.copy()
+        coords[:, :2] = np.maximum(coords[:, :2], 0)
+        if w is not None:
+            coords[:, 2] = np.minimum(coords[:, 2], w)
+        if h is not None:
+            coords[:, 3] = np.minimum(coords[:, 3], h)
+        return BoxArray(coords, dtype = self.data.dtype)
+
+    xmin = property(lambda self: self.data[0])
+    ymin = property(lambda self: self.data[1])
+    xmax = property(lambda self: self.data[2])
+    ymax = property(lambda self: self.data[3])
+    xcenter = property(lambda self: self.data[4])
+    ycenter = property(lambda self: self.data[5])
+
+    @property
+    def coords(self):
+        return self.data[:4].T
+
+    def __array__(self, dtype = None, copy = None):
+        return np.asarray(self.coords, dtype = dtype)
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return Box(self.data[:4, idx].tolist(), clip = False)
+        boxes = BoxArray.__new__(BoxArray)
+        boxes.data = self.data[:, idx]
+        return boxes
+
+    def __iter__(self):
+        for bbox in self.data[:4].T.tolist():
+            yield Box(bbox, clip = False)
+
+    def tolist(self):
+        return self.data[:4].T.tolist()
+
+
+class Words(object):
+    """Columnar OCR words of one table: `boxes` (BoxArray), `texts`, `ids`.
+
+    Also reads like the former {idx : {"box", "text", "id"}} dict, building
+    the record of a word only when it is asked for.
+    """
+    __slots__ = ("boxes", "texts", "ids")
+
+    def __init__(self, boxes : BoxArray, texts : List[str], ids = None):
+        self.boxes = boxes
+        self.texts = texts
+        self.ids = np.arange(len(texts)) if ids is None else np.asarray(ids)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, idx):
+        return {
+            "box" : self.boxes[idx],
+            "text" : self.texts[idx],
+            "id" : int(self.ids[idx])
+        }
+
+    def __iter__(self):
+        return iter(range(len(self.texts)))
+
+    def keys(self):
+        return range(len(self.texts))
+
+    def values(self):
+        for idx, (bbox, text) in enumerate(zip(self.boxes, self.texts)):
+            yield {"box" : bbox, "text" : text, "id" : int(self.ids[idx])}
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
 def get_area_merge(box1, box2):
     x1 = max(box1.xmin, box2.xmin)
     y1 = max(box1.ymin, box2.ymin)
@@ -37,6 +155,40 @@ def is_overlap(box1, box2, threshold = 0.85):
         return True
     return False
 
+def boxes_to_array(boxes):
+    return np.array([[box.xmin, box.ymin, box.xmax, box.ymax] for box in boxes], dtype = np.float64).reshape(-1, 4)
+
+def areas(boxes):
+    boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+    return np.maximum(1, boxes[:, 2] - boxes[:, 0]) * np.maximum(1, boxes[:, 3] - boxes[:, 1])
+
+# batched is_overlap: (N x 4, M x 4) -> N x M ratios, same max(1, ...) clamping and min-area denominator
+# (mode = "first" divides by the area of boxes1 only, like run.is_overlap)
+def overlap_matrix(boxes1, boxes2, mode = "min"):
+    boxes1 = np.asarray(boxes1, dtype = np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype = np.float64).reshape(-1, 4)
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+    area_merge = np.maximum(1, x2 - x1) * np.maximum(1, y2 - y1)
+    if mode == "first":
+        return area_merge / areas(boxes1)[:, None]
+    return area_merge / np.minimum(areas(boxes1)[:, None], areas(boxes2)[None, :])
+
+# overlap_matrix of aligned pairs: boxes1[i] against boxes2[i]
+def overlap_pairs(boxes1, boxes2, mode = "min"):
+    boxes1 = np.asarray(boxes1, dtype = np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype = np.float64).reshape(-1, 4)
+    x1 = np.maximum(boxes1[:, 0], boxes2[:, 0])
+    y1 = np.maximum(boxes1[:, 1], boxes2[:, 1])
+    x2 = np.minimum(boxes1[:, 2], boxes2[:, 2])
+    y2 = np.minimum(boxes1[:, 3], boxes2[:, 3])
+    area_merge = np.maximum(1, x2 - x1) * np.maximum(1, y2 - y1)
+    if mode == "first":
+        return area_merge / areas(boxes1)
+    return area_merge / np.minimum(areas(boxes1), areas(boxes2))
+
 
 def with_line(box1, box2, threshold = 5):
     if abs(box1.ycenter - box2.ycenter) <= threshold:
@@ -45,7 +197,7 @@ def with_line(box1, box2, threshold = 5):
 
 
 def get_color():
-    color = tuple([int(x) for x in np.random.choice(range(256), size=3)])
+    color = tuple(np.random.randint(0, 256, size=3).tolist())
     return color
 
 def draw_rectangle(image, box, color):
@@ -68,6 +220,67 @@ def read_img(filename):
     h, w = image.shape[:2]
     return image, h, w
 
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def exif_orientation(data):
+    if data[:6] != b"Exif\x00\x00":
+        return 1
+    tiff = data[6:]
+    order = "<" if tiff[:2] == b"II" else ">"
+    offset = struct.unpack(order + "I", tiff[4:8])[0]
+    count = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = tiff[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        if len(entry) < 12:
+            break
+        if struct.unpack(order + "H", entry[:2])[0] == 0x0112:
+            return struct.unpack(order + "H", entry[8:10])[0]
+    return 1
+
+def read_jpeg_size(f):
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker == 0xD9 or marker == 0xDA:
+            return None
+        length = struct.unpack(">H", f.read(2))[0]
+        segment = f.read(length - 2)
+        if marker == 0xE1 and orientation == 1:
+            orientation = exif_orientation(segment)
+        if marker in JPEG_SOF:
+            h, w = struct.unpack(">HH", segment[1:5])
+            # cv2.imread applies the EXIF rotation, so follow it
+            if orientation in (5, 6, 7, 8):
+                h, w = w, h
+            return h, w
+
+def read_image_size(filename):
+    # image height / width from the JPEG or PNG header, without decoding pixels
+    try:
+        with open(filename, "rb") as f:
+            head = f.read(24)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                w, h = struct.unpack(">II", head[16:24])
+                return h, w
+            if head[:2] == b"\xff\xd8":
+                f.seek(2)
+                size = read_jpeg_size(f)
+                if size is not None:
+                    return size
+    except (OSError, struct.error, IndexError):
+        pass
+    _, h, w = read_img(filename)
+    return h, w
+
 def xywh2xyxy(box):
     x, y, w, h = box
     xmin = x - w / 2
@@ -85,22 +298,43 @@ dict_label = {
     5 : "table_spanning_cell"
 }
 
+def read_labels(filename):
+    # YOLO label file as (class ids int8 (n,), normalized xywh float64 (n, 4)), parsed in one call
+    with open(filename, "rb") as f:
+        content = f.read()
+    values = content.split()
+    # the flat parse is only right when every non-empty line has exactly five columns
+    num_lines = sum(1 for line in content.splitlines() if line.strip())
+    if len(values) == 5 * num_lines:
+        data = np.array(values, dtype = np.float64).reshape(-1, 5)
+    else:
+        # lines with extra columns: keep the first five like the line-by-line parser did
+        with open(filename, "r") as f:
+            data = np.array([line.strip().split(" ")[:5] for line in f], dtype = np.float64).reshape(-1, 5)
+    return data[:, 0].astype(np.int8), data[:, 1:]
+
+def yolo_to_boxes(classes, xywh, h_img, w_img, clip : bool = True):
+    # normalized YOLO rows to (BoxArray, class ids), same arithmetic as xywh2xyxy on each row
+    xc, yc, wc, hc = np.asarray(xywh, dtype = np.float64).reshape(-1, 4).T
+    xc = xc * w_img
+    yc = yc * h_img
+    wc = wc * w_img / 2
+    hc = hc * h_img / 2
+    coords = np.empty((len(xc), 4), dtype = np.float64)
+    np.subtract(xc, wc, out = coords[:, 0])
+    np.subtract(yc, hc, out = coords[:, 1])
+    np.add(xc, wc, out = coords[:, 2])
+    np.add(yc, hc, out = coords[:, 3])
+    if clip:
+        # Box clipping without an image size: 0 from below only
+        np.maximum(coords[:, :2], 0, out = coords[:, :2])
+    return BoxArray(coords), np.asarray(classes, dtype = np.int8)
+
 def read_file(filename):
+    # ((BoxArray, class ids), h, w); ids are keys of dict_label
     img_path = filename.replace("labels", "images").split(".")[0] + ".jpg"
-    _, h_img, w_img = read_img(img_path)
-
-    with open(filename, "r") as f:
-        data = f.readlines()
-    result = []
-    for d in data:
-        d = d.strip().split(" ")
-        label = int(d[0])
-        xc = float(d[1]) * w_img
-        yc = float(d[2]) * h_img
-        wc = float(d[3]) * w_img
-        hc = float(d[4]) * h_img
-        result.append((Box(xywh2xyxy([xc, yc, wc, hc])), dict_label[label]))
-    return result, h_img, w_img
+    h_img, w_img = read_image_size(img_path)
+    return yolo_to_boxes(*read_labels(filename), h_img, w_img), h_img, w_img
 
 def getxyxy(box):
     bbox = []
@@ -112,18 +346,111 @@ def getxyxy(box):
     ymax = max(bbox[1::2])
     return [xmin, ymin, xmax, ymax]
 
-def read_ocr(filename, h_img, w_img):
-    with open(filename, 'r') as f:
-        data = json.load(f)
-    result = {}
-    for idx, d in enumerate(data):
-        print(d['bbox'])
-        result[idx] = {
-            "box" : Box(bbox = d['bbox'], h = h_img, w = w_img),
-            "text" : d['text'],
-            "id" : idx
-        }
-    return result
+def polygons_to_xyxy(polygons):
+    # getxyxy over a list of point lists, in one pass when all have the same number of points
+    try:
+        points = np.asarray(polygons, dtype = np.float64)
+    except ValueError:
+        points = None
+    if points is None or points.ndim != 3 or points.shape[2] != 2:
+        return np.asarray([getxyxy(p) for p in polygons], dtype = np.float64).reshape(-1, 4)
+    return np.concatenate([points.min(axis = 1), points.max(axis = 1)], axis = 1)
+
+def load_json(filename):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # e.g. NaN or integers beyond 64 bits, which json still accepts
+            pass
+    return json.loads(raw)
+
+def encode_texts(texts : List[str]):
+    # (n + 1 int64 offsets, utf-8 blob): text i is blob[offsets[i]:offsets[i + 1]]
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype = "<i8")
+    np.cumsum([len(t) for t in encoded], out = offsets[1:])
+    return offsets, b"".join(encoded)
+
+def decode_texts(offsets, blob):
+    # inverse of encode_texts; blob may carry padding after the last text
+    offsets = np.asarray(offsets).tolist()
+    blob = bytes(blob)
+    return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+# cache file: header, then coords (n, 4) float64 and the encode_texts offsets and blob
+WORDS_CACHE = struct.Struct("<4sqqq")
+WORDS_MAGIC = b"OCW1"
+
+def load_words_cache(path, source):
+    """Columnar (coords, texts) saved by `save_words_cache` for `source`.
+
+    Returns None when there is no cache or it was written for another
+    version (size or mtime) of the source file.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(source)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if len(raw) < WORDS_CACHE.size:
+        return None
+    magic, n, size, mtime_ns = WORDS_CACHE.unpack_from(raw)
+    if magic != WORDS_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+        return None
+    pos = WORDS_CACHE.size
+    coords = np.frombuffer(raw, dtype = "<f8", count = 4 * n, offset = pos).reshape(n, 4)
+    pos += 32 * n
+    offsets = np.frombuffer(raw, dtype = "<i8", count = n + 1, offset = pos)
+    pos += 8 * (n + 1)
+    return coords, decode_texts(offsets, raw[pos:])
+
+def save_words_cache(path, source, coords, texts):
+    # words with non-string text are not cached
+    if path is None or not all(isinstance(t, str) for t in texts):
+        return
+    offsets, blob = encode_texts(texts)
+    stat = os.stat(source)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(WORDS_CACHE.pack(WORDS_MAGIC, len(texts), stat.st_size, stat.st_mtime_ns))
+        f.write(np.ascontiguousarray(coords, dtype = "<f8").reshape(-1, 4).tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(tmp, path)
+
+def cache_path(cache_dir, filename):
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, os.path.basename(filename) + ".bin")
+
+def load_words(filename, cache_dir = None, key = None, to_xyxy = None):
+    """Parses an OCR json file into (coords (N, 4) float64, texts).
+
+    `key` selects the word list inside the top-level object, `to_xyxy` turns
+    the list of raw bboxes into coordinates. With `cache_dir` the parsed
+    result is saved there as `<file>.bin` and reused while the json file is
+    unchanged.
+    """
+    path = cache_path(cache_dir, filename)
+    cached = load_words_cache(path, filename)
+    if cached is not None:
+        return cached
+    data = load_json(filename)
+    if key is not None:
+        data = data[key]
+    bboxes = [d['bbox'] for d in data]
+    coords = to_xyxy(bboxes) if to_xyxy is not None else np.asarray(bboxes, dtype = np.float64).reshape(-1, 4)
+    texts = [d['text'] for d in data]
+    save_words_cache(path, filename, coords, texts)
+    return coords, texts
+
+def read_ocr(filename, h_img, w_img, cache_dir = None):
+    coords, texts = load_words(filename, cache_dir)
+    return Words(BoxArray.from_list(coords, h = h_img, w = w_img), texts)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import glob
+from typing import *
+from checkpoint import truncate_partial_line
+
+LANG = "vi"
+INFO = {
+    "author" : "ThanThoai",
+    "version" : 1.0
+}
+
+
+class AnnotationWriter(object):
+    """Writes one table annotation per line (JSONL) as soon as it is built.
+
+    With `max_bytes` or `max_tables` set, output rolls over to numbered part
+    files `<stem>-00000.jsonl`, `<stem>-00001.jsonl`, ... With `append` the
+    existing output of an interrupted run is kept and extended.
+    """
+
+    def __init__(self, path : str, max_bytes : int = None, max_tables : int = None, fsync : bool = False, append : bool = False):
+        self.stem, ext = os.path.splitext(path)
+        self.ext = ext or ".jsonl"
+        self.max_bytes = max_bytes
+        self.max_tables = max_tables
+        self.fsync = fsync
+        self.rolling = max_bytes is not None or max_tables is not None
+        self.paths = []
+        self.file = None
+        self.part = 0
+        self.num_bytes = 0
+        self.num_tables = 0
+        self.append = append
+        if append:
+            self.paths = sorted(glob.glob(glob.escape(self.stem) + "-[0-9][0-9][0-9][0-9][0-9]" + self.ext)) if self.rolling else [p for p in [self.stem + self.ext] if os.path.exists(p)]
+            for path in self.paths[-1:]:
+                truncate_partial_line(path)
+            if self.rolling and len(self.paths) > 0:
+                self.part = int(self.paths[-1][len(self.stem) + 1:-len(self.ext)]) + 1
+
+    def next_path(self):
+        if not self.rolling:
+            return self.stem + self.ext
+        path = f"{self.stem}-{self.part:05d}{self.ext}"
+        self.part += 1
+        return path
+
+    def open(self):
+        path = self.next_path()
+        mode = 'a' if self.append and path in self.paths else 'w'
+        self.file = open(path, mode, encoding = "utf-8")
+        if path not in self.paths:
+            self.paths.append(path)
+        self.num_bytes = 0
+        self.num_tables = 0
+
+    def full(self):
+        if self.max_bytes is not None and self.num_bytes >= self.max_bytes:
+            return True
+        if self.max_tables is not None and self.num_tables >= self.max_tables:
+            return True
+        return False
+
+    def write(self, anno : Dict):
+        self.write_line(json.dumps(anno, ensure_ascii=False))
+
+    def write_line(self, line : str):
+        # one already encoded annotation, e.g. from export.AnnotationColumns.encode
+        if self.file is None or (self.rolling and self.full()):
+            self.close()
+            self.open()
+        line = line + "\n"
+        self.file.write(line)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.num_bytes += len(line.encode("utf-8"))
+        self.num_tables += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+ID_PREFIX = '{"id": '
+decoder = json.JSONDecoder()
+
+def line_id(line : str):
+    # the id of a table line without parsing its document: encode_table
+    # (and json.dumps of {"id" : ..., ...}) write it first
+    if line.startswith(ID_PREFIX):
+        return decoder.raw_decode(line, len(ID_PREFIX))[0]
+    return json.loads(line)["id"]
+
+def iter_lines(paths : List[str], unique : bool = False):
+    # unique drops repeated table ids, e.g. a table written again after a
+    # resumed run was interrupted before its checkpoint entry
+    seen = set()
+    for path in paths:
+        with open(path, 'r', encoding = "utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                if unique:
+                    key = line_id(line)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield line
+
+def iter_annotations(paths : List[str]):
+    for line in iter_lines(paths):
+        yield json.loads(line)
+
+def assemble(paths : List[str], filename : str, lang : str = LANG, info : Dict = INFO, unique : bool = False):
+    # streams the legacy {"lang", "info", "documents"} file, byte-identical to
+    # json.dump of the full dict, without holding the documents in memory
+    head = json.dumps({"lang" : lang, "info" : info, "documents" : []}, ensure_ascii=False)
+    with open(filename, 'w', encoding = "utf-8") as f:
+        f.write(head[:-2])
+        for idx, line in enumerate(iter_lines(paths, unique)):
+            if idx > 0:
+                f.write(", ")
+            f.write(line)
+        f.write(head[-2:])
+
+
+if __name__ == '__main__':
+    # python writer.py legacy.json part-00000.jsonl part-00001.jsonl ...
+    assemble(sys.argv[2:], sys.argv[1])